@@ -1,22 +1,47 @@
 """Coding agent implementation."""
 
+import asyncio
+import functools
 import shutil
-import yaml
 from pathlib import Path
 
-import anthropic
 from dotenv import load_dotenv
 from loguru import logger
 
-from pythoneer.codebase import Codebase
+from pythoneer.cache import ObservationCache, ResponseCache
+from pythoneer.codebase import Codebase, SourceFile
 from pythoneer.messages import MessageLog, InstanceMessage, AssistantMessage, UserMessage
 from pythoneer.trajectory import Trajectory, TrajectoryStep
-from pythoneer.llm import parse_tool_use_response
-from pythoneer.tools import register_all_tools, ToolFactory
+from pythoneer.llm import parse_tool_use_response, ToolCall, ToolUseResponse
+from pythoneer.tools import register_all_tools, ToolFactory, Tool, Observation
+from pythoneer.tools.sandbox import DockerSandbox
 
 # Load the .env file - this is where your Anthropic API key should be stored.
 load_dotenv()
 
+PROMPT_CACHING_BETA = "prompt-caching-2024-07-31"
+"""Anthropic beta feature flag that enables prompt caching."""
+
+CACHE_CONTROL = {"type": "ephemeral"}
+"""Marks the end of a prompt prefix that should be cached by the Anthropic API."""
+
+
+@functools.lru_cache(maxsize=None)
+def _load_config(config_file: str, modified_time: int) -> dict:
+    """
+    Load and parse a config file.
+
+    The parsed config is cached, so that agents created with the same config file do not read
+    and parse it again. The modification time of the file is part of the cache key, so that the
+    file is reloaded if it changes. The returned config is shared, so it must not be modified.
+    """
+    # PyYAML is slow to import, so it is only imported when a config file is first loaded
+    import yaml
+
+    with open(config_file, "rb") as fh:
+        # Use the libyaml-backed loader when available, as it is much faster
+        return yaml.load(fh, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+
 
 class Agent:
     """Coding agent."""
@@ -44,17 +69,56 @@ class Agent:
             Full path to the agent's workspace directory. This is where the agent will save
             the modified codebase, and write any other files that it needs to.
         """
-        with open(config_file) as fh:
-            self.config = yaml.safe_load(fh)
+        # The Anthropic SDK is slow to import, so it is only imported when an agent is created
+        # (and not, e.g., when only parsing command-line arguments)
+        import anthropic
+
+        config_file = Path(config_file)
+        self.config = _load_config(str(config_file.resolve()), config_file.stat().st_mtime_ns)
 
         self.model = self.config["model"]["name"]
 
+        # A single client is reused across steps, so that connections to the API are kept alive
+        self.client = anthropic.AsyncAnthropic(
+            default_headers={"anthropic-beta": PROMPT_CACHING_BETA}
+        )
+
         self.tools = self.config["agent"]["tools"]
         self.summarise_before_last = self.config["agent"]["summarise_before_last"]
+        # Environments whose containers are started in the background when the agent is created
+        self.warm_environments = self.config["agent"].get("warm_environments", [])
+        # Maximum number of seconds that a script or the tests can run for in the sandbox
+        self.command_timeout = self.config["agent"].get("command_timeout", 900)
+        # Maximum number of parallel-safe tools to use concurrently within a single step
+        self.tool_concurrency_limit = self.config["agent"].get("tool_concurrency_limit", 4)
+
+        # Responses are only cached if a cache directory is configured, as the request always
+        # grows within a run, so a response can only be reused by a later run
+        response_cache_dir = self.config["agent"].get("response_cache_dir")
+        self.response_cache = (
+            ResponseCache(response_cache_dir) if response_cache_dir is not None else None
+        )
+
+        # Observations from cacheable tools, keyed by the tool, its arguments and the version of
+        # the codebase that it was used with
+        self.tool_observation_cache = ObservationCache(
+            self.config["agent"].get("tool_observation_cache_size", 128)
+        )
 
         # Register the tools
         register_all_tools()
 
+        # The tool descriptions never change, so they are built once. They are marked for prompt
+        # caching up to (and including) the last tool description.
+        self._tool_descriptions = [
+            ToolFactory.TOOL_NAME_TO_CLASS[tool_name].json_description() for tool_name in self.tools
+        ]
+        if self._tool_descriptions:
+            self._tool_descriptions[-1] = {
+                **self._tool_descriptions[-1],
+                "cache_control": CACHE_CONTROL,
+            }
+
         # Set up the agent's workspace directory
         self.workspace_path = Path(workspace_path)
         if self.workspace_path.exists() and self.workspace_path.is_dir():
@@ -62,13 +126,18 @@ class Agent:
         self.workspace_path.mkdir(parents=True, exist_ok=True)
 
         self.codebase = Codebase(codebase_path)
-        self.message_log = MessageLog()
-        self.trajectory = Trajectory()
+        self.message_log = MessageLog(summarise_before_last=self.summarise_before_last)
+        self.trajectory = Trajectory(self.workspace_path)
+
+        # Docker containers to run code in. The containers are started when first needed.
+        self.sandbox = DockerSandbox()
 
         self.step_number: int = 0
         self.task_completed: bool = False
 
         self.open_file_relative_path: str | None = None
+        # Direct reference to the open file, to avoid looking it up in the codebase every step
+        self._open_source_file: SourceFile | None = None
 
         # Load the prompts
         self._load_prompts()
@@ -76,6 +145,10 @@ class Agent:
         instance_message = InstanceMessage(self.instance_prompt)
         self.message_log.add_message(instance_message)
 
+        # Start any slow setup for the tools, while the first response is generated
+        for tool_name in self.tools:
+            ToolFactory.TOOL_NAME_TO_CLASS[tool_name].prepare(self)
+
     def _load_prompts(self) -> None:
         """Load the prompts from the config file."""
         self.system_prompt = self.config["prompts"]["system_prompt"]
@@ -84,16 +157,25 @@ class Agent:
         )
         self.next_step_prompt_template = self.config["prompts"]["next_step_prompt_template"]
 
+        # Mapping of open file paths to rendered next step prompts. The prompt only depends on
+        # the open file, so each prompt is only rendered once.
+        self._next_step_prompts: dict[str | None, str] = {}
+
+        # The system prompt in the format expected by the API, marked for prompt caching
+        self._system = [
+            {"type": "text", "text": self.system_prompt, "cache_control": CACHE_CONTROL}
+        ]
+
         logger.info(f"📝 System prompt:\n{self.system_prompt}")
         logger.info(f"📝 Instance prompt:\n{self.instance_prompt}")
 
-    def run(self) -> None:
+    async def run(self) -> None:
         """Run the agent."""
         error_occured = False
 
         while not self.task_completed:
             try:
-                self.step()
+                await self.step()
             except Exception as exc:
                 logger.exception(f"An error occurred: {exc}")
                 error_occured = True
@@ -101,72 +183,182 @@ class Agent:
 
         self.finish(error_occured)
 
-    def step(self) -> None:
+    async def step(self) -> None:
         """
         A single step of the agent.
 
-        The agent generates a message, uses a tool, and receives an observation.
+        The agent generates a message, uses one or more tools, and receives an observation for
+        each tool use.
+
+        While waiting for the language model to respond, any source files that have not been
+        read yet are read in the background, ready for the tools that need the whole codebase.
         """
         self.step_number += 1
 
-        messages = self.message_log.return_messages_list(
-            summarise_before_last=self.summarise_before_last
-        )
-        tool_descriptions = [
-            ToolFactory.TOOL_NAME_TO_CLASS[tool_name].json_description() for tool_name in self.tools
-        ]
+        messages = self.message_log.return_messages_list()
+
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": 2056,
+            "system": self._system,
+            "tools": self._tool_descriptions,
+        }
+
+        load_files_task = asyncio.create_task(asyncio.to_thread(self.codebase.load_files))
+
+        # The files are always waited for, so that an error while reading them is raised even if
+        # the request fails
+        try:
+            if self.response_cache is not None:
+                cache_key = ResponseCache.request_key(request)
+                response = self.response_cache.get(cache_key)
+            else:
+                response = None
+
+            if response is None:
+                # The raw response is requested, so that the SDK does not build a model from it
+                raw_response = await self.client.messages.with_raw_response.create(**request)
+                response = parse_tool_use_response(raw_response.content)
+                if self.response_cache is not None and self._is_cacheable(response):
+                    self.response_cache.set(cache_key, response)
+            else:
+                logger.info("♻️ Using cached response.")
+        finally:
+            await load_files_task
+
+        # The thought is only shown once, alongside the first tool use of the step
+        thought = response.thought
+        for batch in self._create_tool_batches(response.tool_calls):
+            observations = await self._use_tools([tool_instance for _, tool_instance in batch])
+            for (tool_call, _), observation in zip(batch, observations):
+                self._record_tool_use(thought, tool_call, observation)
+                thought = ""
+
+    def _is_cacheable(self, response: ToolUseResponse) -> bool:
+        """
+        Whether a response can be cached.
 
-        response = anthropic.Anthropic().messages.create(
-            model=self.model,
-            messages=messages,
-            max_tokens=2056,
-            system=self.system_prompt,
-            tools=tool_descriptions,
-        )
-        response = parse_tool_use_response(response)
+        Only responses that request informational tools are cached, so that commands and edits
+        are never replayed from the cache.
+        """
+        for tool_call in response.tool_calls:
+            tool_class = ToolFactory.TOOL_NAME_TO_CLASS.get(tool_call.tool_name)
+            if tool_class is None or not tool_class.INFORMATIONAL:
+                return False
 
-        assistant_message = AssistantMessage(
-            thought=response.thought,
-            tool_id=response.tool_id,
-            tool_name=response.tool_name,
-            tool_arguments=response.tool_arguments,
+        return True
+
+    def _create_tool_batches(self, tool_calls: list[ToolCall]) -> list[list[tuple[ToolCall, Tool]]]:
+        """
+        Group the requested tool calls into batches that can be used concurrently.
+
+        Consecutive parallel-safe tools are grouped into a single batch. Any other tool is placed
+        in a batch of its own, so that tools which change the state of the agent (e.g., the open
+        file) are used in the order that they were requested.
+
+        Parameters
+        ----------
+        tool_calls : list[ToolCall]
+            The tool calls requested by the language model, in order.
+
+        Returns
+        -------
+        batches : list[list[tuple[ToolCall, Tool]]]
+            The batches of tool calls, and the corresponding tool instances, in order.
+        """
+        batches = []
+
+        for tool_call in tool_calls:
+            tool_instance = ToolFactory.create_tool(tool_call.tool_name, **tool_call.tool_arguments)
+
+            if batches and tool_instance.PARALLEL_SAFE and batches[-1][-1][1].PARALLEL_SAFE:
+                batches[-1].append((tool_call, tool_instance))
+            else:
+                batches.append([(tool_call, tool_instance)])
+
+        return batches
+
+    async def _use_tools(self, tool_instances: list[Tool]) -> list[Observation]:
+        """
+        Use a batch of tools, concurrently if there is more than one, and get the observations.
+
+        The tools are used in worker threads, so that the event loop is not blocked.
+        """
+        return await asyncio.to_thread(
+            ToolFactory.use_many, tool_instances, self, self.tool_concurrency_limit
         )
-        self.message_log.add_message(assistant_message)
-        logger.info(f"🤖 Assistant message:\n{assistant_message.return_json_message()}")
 
-        tool_instance = ToolFactory.create_tool(response.tool_name, **response.tool_arguments)
+    def open_file(self, relative_file_path: str) -> SourceFile:
+        """
+        Open a file from the codebase in the file viewer.
 
-        # Use the tool, and get an observation
-        observation = tool_instance.use(self)
+        Parameters
+        ----------
+        relative_file_path : str
+            Path of the file to open, relative to the root of the codebase.
 
-        next_step_prompt = self.next_step_prompt_template.format(
-            open_file=self.open_file_relative_path
+        Returns
+        -------
+        source_file : SourceFile
+            The file that was opened.
+        """
+        self.open_file_relative_path = relative_file_path
+        self._open_source_file = self.codebase.retrieve_file(relative_file_path)
+        return self._open_source_file
+
+    def _next_step_prompt(self) -> str:
+        """Return the next step prompt for the file that is currently open."""
+        open_file = self.open_file_relative_path
+        if open_file not in self._next_step_prompts:
+            self._next_step_prompts[open_file] = self.next_step_prompt_template.format(
+                open_file=open_file
+            )
+        return self._next_step_prompts[open_file]
+
+    def _record_tool_use(self, thought: str, tool_call: ToolCall, observation: Observation) -> None:
+        """Add the messages for a tool use to the message log, and update the trajectory."""
+        assistant_message = AssistantMessage(
+            thought=thought,
+            tool_id=tool_call.tool_id,
+            tool_name=tool_call.tool_name,
+            tool_arguments=tool_call.tool_arguments,
+        )
+        self.message_log.add_message(assistant_message)
+        # The messages are only serialised if the log level is enabled
+        logger.opt(lazy=True).info(
+            "🤖 Assistant message:\n{}", lambda: assistant_message.return_json_message()
         )
 
+        next_step_prompt = self._next_step_prompt()
+
         if observation.review_comment:
-            logger.info(f"🔍 Review comment:\n{observation.review_comment}")
+            logger.info("🔍 Review comment:\n{}", observation.review_comment)
 
         user_message = UserMessage(
-            tool_id=response.tool_id,
+            tool_id=tool_call.tool_id,
             observation=observation.observation_description,
             summarised_observation=observation.summarised_observation_description,
             next_step_prompt=next_step_prompt,
             review_comment=observation.review_comment,
         )
         self.message_log.add_message(user_message)
-        logger.info(f"🐼 User message:\n{user_message.return_json_message()}")
+        logger.opt(lazy=True).info(
+            "🐼 User message:\n{}", lambda: user_message.return_json_message()
+        )
 
-        if self.open_file_relative_path:
-            file_viewer_content = self.codebase.retrieve_file(self.open_file_relative_path).contents
+        # The contents of the file viewer are only stored in the trajectory when they change
+        if observation.file_viewer_changed and self._open_source_file:
+            file_viewer_content = self._open_source_file.contents
         else:
             file_viewer_content = None
 
         # Update the trajectory
         trajectory_step = TrajectoryStep(
             step_number=self.step_number,
-            thought=response.thought,
-            tool_name=response.tool_name,
-            tool_arguments=response.tool_arguments,
+            thought=thought,
+            tool_name=tool_call.tool_name,
+            tool_arguments=tool_call.tool_arguments,
             terminal_output=observation.terminal_output,
             terminal_content=observation.terminal_content,
             file_viewer_changed=observation.file_viewer_changed,
@@ -177,11 +369,12 @@ class Agent:
         self.trajectory.add_step(trajectory_step)
 
     def finish(self, error_occured: bool = False) -> None:
-        """Write the codebase and trajectory to disk."""
+        """Remove the sandbox, and write the codebase and trajectory to disk."""
         if error_occured:
             logger.info("Task failed.")
         else:
             logger.info(f"Task completed in {self.step_number} steps.")
 
+        self.sandbox.close()
         self.codebase.write_codebase_to_disk(self.workspace_path)
         self.trajectory.write_to_disk(self.workspace_path)
@@ -0,0 +1,154 @@
+"""Client-side caches of responses from the Anthropic LM API, and of tool observations."""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import asdict
+from pathlib import Path
+
+from pythoneer.llm import ToolCall, ToolUseResponse
+
+if TYPE_CHECKING:
+    from pythoneer.tools.observations import Observation
+
+
+class ResponseCache:
+    """
+    Cache of parsed language model responses, keyed by the request that produced them.
+
+    The cache complements Anthropic's server-side prompt caching: when exactly the same request
+    is made again (e.g., when re-running a task), the response is returned without calling the
+    API at all.
+    """
+
+    FILE_NAME = "response_cache.jsonl"
+    """
+    Name of the file that the cache is persisted to. Each response is appended to the file as a
+    single JSON line, so that caching a response does not rewrite the whole file.
+    """
+
+    def __init__(self, cache_dir: str | Path | None = None) -> None:
+        """
+        Initialise the ResponseCache object.
+
+        Parameters
+        ----------
+        cache_dir : str | Path | None
+            Directory to persist the cache to, so that it can be reused across runs. If None,
+            the cache is only held in memory.
+        """
+        self.cache_file = Path(cache_dir) / self.FILE_NAME if cache_dir is not None else None
+
+        # Mapping of request keys to JSON serialisable responses
+        self.responses: dict[str, dict] = {}
+
+        # Whether the last line of the file is incomplete, which happens if a previous run was
+        # interrupted while writing it. The next record is then started on a new line.
+        self._incomplete_last_line = False
+
+        if self.cache_file is not None and self.cache_file.exists():
+            with open(self.cache_file) as fh:
+                for line in fh:
+                    self._incomplete_last_line = not line.endswith("\n")
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self.responses[record["key"]] = record["response"]
+
+    @staticmethod
+    def request_key(request: dict) -> str:
+        """
+        Return the key for a request.
+
+        Parameters
+        ----------
+        request : dict
+            The keyword arguments of the request to the Anthropic LM API.
+
+        Returns
+        -------
+        key : str
+            A hash of the canonical JSON representation of the request.
+        """
+        canonical_request = json.dumps(request, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical_request.encode()).hexdigest()
+
+    def get(self, key: str) -> ToolUseResponse | None:
+        """Return the cached response for a request key, or None if there is no cached response."""
+        response = self.responses.get(key)
+        if response is None:
+            return None
+
+        return ToolUseResponse(
+            thought=response["thought"],
+            tool_calls=[ToolCall(**tool_call) for tool_call in response["tool_calls"]],
+        )
+
+    def set(self, key: str, response: ToolUseResponse) -> None:
+        """Cache the response for a request key, and persist it if applicable."""
+        self.responses[key] = asdict(response)
+
+        if self.cache_file is not None:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            record = json.dumps({"key": key, "response": self.responses[key]}) + "\n"
+            if self._incomplete_last_line:
+                record = "\n" + record
+                self._incomplete_last_line = False
+
+            with open(self.cache_file, "a") as fh:
+                fh.write(record)
+
+
+class ObservationCache:
+    """
+    Cache of observations from tools, keyed by the tool, its arguments and the version of the
+    codebase that it was used with.
+
+    Only observations that depend on nothing but the arguments and the codebase are cached (e.g.,
+    from opening a file), as the version of the codebase changes whenever it is modified. The
+    cache holds at most a fixed number of observations, as observations can contain large outputs
+    (e.g., the contents of a file). When the cache is full, the least recently used
+    observation is evicted. Tools can be used concurrently in worker threads, so the cache is
+    guarded by a lock.
+    """
+
+    def __init__(self, max_size: int = 128) -> None:
+        """
+        Initialise the ObservationCache object.
+
+        Parameters
+        ----------
+        max_size : int
+            The maximum number of observations to hold.
+        """
+        if max_size < 1:
+            raise ValueError(f"The maximum size of the cache must be positive, got {max_size}.")
+
+        self.max_size = max_size
+        self._observations: OrderedDict[tuple[str, str, int], Observation] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """The number of cached observations."""
+        return len(self._observations)
+
+    def get(self, key: tuple[str, str, int]) -> Observation | None:
+        """Return the cached observation for a key, or None if there is no cached observation."""
+        with self._lock:
+            observation = self._observations.get(key)
+            if observation is not None:
+                self._observations.move_to_end(key)
+            return observation
+
+    def set(self, key: tuple[str, str, int], observation: Observation) -> None:
+        """Cache the observation for a key, evicting the least recently used one if full."""
+        with self._lock:
+            self._observations[key] = observation
+            self._observations.move_to_end(key)
+            if len(self._observations) > self.max_size:
+                self._observations.popitem(last=False)
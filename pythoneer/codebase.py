@@ -2,15 +2,24 @@
 
 from __future__ import annotations
 
+import os
 import shutil
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+WRITE_CHUNK_SIZE = 128 * 1024
+"""Maximum number of bytes to write to a file in a single system call."""
+
 
 class Codebase:
     """Class to represent a codebase."""
 
-    PATTERNS = ["**/*.py", "**/*.toml"]
-    """Patterns to match source files to include in the codebase."""
+    SUFFIXES = (".py", ".toml")
+    """File name suffixes of the source files to include in the codebase."""
+
+    IGNORED_DIRECTORIES = frozenset({"__pycache__", "node_modules"})
+    """Directories that are never walked. Hidden directories are also never walked."""
 
     def __init__(self, codebase_path: str | Path) -> None:
         """
@@ -26,19 +35,114 @@ class Codebase:
         # Mapping of relative file paths to SourceFile objects
         self.files = {}
 
-        # Add all source files in the codebase to the codebase object
-        for pattern in self.PATTERNS:
-            for file_path in self.codebase_path.glob(pattern):
-                relative_file_path = file_path.relative_to(self.codebase_path)
-                # Skip hidden files
-                if not any(part.startswith(".") for part in relative_file_path.parts):
-                    file_contents = file_path.read_text()
-                    self.add_file(str(relative_file_path), file_contents)
-
-    def add_file(self, relative_file_path: str, file_contents: str) -> None:
-        """Add a new source file to the codebase."""
-        source_file = SourceFile(relative_file_path, file_contents)
+        # Cached result of `formatted_relative_file_paths`. Reset whenever a file is added.
+        self._formatted_paths_cache: str | None = None
+
+        # Incremented whenever a file is added or edited, to identify the state of the codebase
+        self.version = 0
+
+        # The directory that the codebase was last written to, and the files that have been added
+        # or edited since. Used to only rewrite the changed files when writing to it again.
+        self._written_codebase_path: Path | None = None
+        self._dirty_files: set[str] = set()
+
+        # Add all source files in the codebase to the codebase object. The files are added in
+        # sorted order, so that the file listing shown to the agent is deterministic. The
+        # contents are read lazily, the first time that they are needed.
+        for relative_file_path, file_path in sorted(self._find_source_files()):
+            self.add_file(relative_file_path, file_path=file_path)
+
+    def _find_source_files(self) -> list[tuple[str, str]]:
+        """
+        Find all source files in the codebase that end with one of the `SUFFIXES`.
+
+        The codebase is walked with `os.scandir`, which is considerably faster than
+        `Path.glob` as no `Path` objects are created. Hidden files are skipped, and hidden
+        directories (and any of the `IGNORED_DIRECTORIES`) are not walked at all. Symlinks to
+        files and directories are followed, but a directory that has already been walked (for
+        example through a symlink back to one of its parents) is not walked again.
+
+        Returns
+        -------
+        source_files : list[tuple[str, str]]
+            The relative path and full path of each source file.
+        """
+        source_files = []
+
+        # Each directory is walked alongside its path relative to the root of the codebase, so
+        # that the relative file paths are built by joining strings rather than parsing paths
+        directories = [(str(self.codebase_path), "")]
+
+        # The device and inode of each directory that has been queued, so that symlinked
+        # directories cannot cause a directory to be walked more than once, or forever
+        root_stat = os.stat(self.codebase_path)
+        seen_directories = {(root_stat.st_dev, root_stat.st_ino)}
+
+        while directories:
+            directory, relative_directory = directories.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir():
+                        if entry.name in self.IGNORED_DIRECTORIES:
+                            continue
+                        stat = entry.stat()
+                        if (stat.st_dev, stat.st_ino) in seen_directories:
+                            continue
+                        seen_directories.add((stat.st_dev, stat.st_ino))
+                        relative_path = os.path.join(relative_directory, entry.name)
+                        directories.append((entry.path, relative_path))
+                    elif entry.name.endswith(self.SUFFIXES) and entry.is_file():
+                        relative_path = os.path.join(relative_directory, entry.name)
+                        source_files.append((relative_path, entry.path))
+
+        return source_files
+
+    def add_file(
+        self,
+        relative_file_path: str,
+        file_contents: str | None = None,
+        file_path: str | Path | None = None,
+    ) -> None:
+        """
+        Add a new source file to the codebase.
+
+        Parameters
+        ----------
+        relative_file_path : str
+            Path of the source file relative to the root of the codebase.
+
+        file_contents : str | None
+            The contents of the source file. Either this or `file_path` must be provided.
+
+        file_path : str | Path | None
+            Full path to an existing file on disk to lazily read the contents from.
+        """
+        # The path is interned, as the same path is used repeatedly to look up the file
+        relative_file_path = sys.intern(relative_file_path)
+        source_file = SourceFile(relative_file_path, file_contents, file_path)
         self.files[relative_file_path] = source_file
+        self._formatted_paths_cache = None
+        self._dirty_files.add(relative_file_path)
+        self.version += 1
+
+    def load_files(self) -> None:
+        """
+        Read the contents of all source files that have not been read yet.
+
+        The files are read concurrently, as reading many small files is dominated by I/O latency.
+        """
+        unloaded_files = [
+            source_file for source_file in self.files.values() if not source_file.loaded
+        ]
+        if not unloaded_files:
+            return
+
+        max_workers = min(32, (os.cpu_count() or 1) * 4, len(unloaded_files))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Consume the iterator, so that any errors are raised
+            list(executor.map(SourceFile.load, unloaded_files))
 
     def retrieve_file(self, relative_file_path: str) -> SourceFile:
         """Retrieve a SourceFile object from the codebase."""
@@ -46,19 +150,32 @@ class Codebase:
 
     def edit_file(self, relative_file_path: str, contents: str) -> None:
         """Edit the contents of a source file in the codebase."""
-        self.files[relative_file_path].update_contents(contents)
+        source_file = self.files[relative_file_path]
+        unchanged = source_file.contents == contents
+        source_file.update_contents(contents)
+
+        # An edit that leaves the contents unchanged does not change the state of the codebase,
+        # so the file does not need to be written to disk again
+        if not unchanged:
+            self._dirty_files.add(relative_file_path)
+            self.version += 1
 
     def formatted_relative_file_paths(self) -> str:
         """Return a formatted string of all relative file paths in the codebase."""
-        relative_file_paths_w_bullets = [
-            f"* {relative_file_path}" for relative_file_path in self.get_relative_file_paths()
-        ]
-        return "\n".join(relative_file_paths_w_bullets)
+        if self._formatted_paths_cache is None:
+            self._formatted_paths_cache = "\n".join(
+                f"* {relative_file_path}" for relative_file_path in self.files
+            )
+        return self._formatted_paths_cache
 
     def get_relative_file_paths(self) -> list[str]:
         """Return a list of all relative file paths in the codebase."""
         return list(self.files.keys())
 
+    def contains_file(self, relative_file_path: str) -> bool:
+        """Whether a source file exists in the codebase."""
+        return relative_file_path in self.files
+
     def write_codebase_to_disk(self, output_path: str | Path) -> None:
         """
         Write the codebase to disk.
@@ -66,6 +183,10 @@ class Codebase:
         Writes the codebase to a new directory at the specified output path. The directory
         structure of the codebase is preserved.
 
+        If the codebase was most recently written to the same output path, only the files that
+        have been added or edited since are written. Any changes made to the files on disk by
+        anything other than the codebase are not detected.
+
         Parameters
         ----------
         output_path : str | Path
@@ -80,26 +201,82 @@ class Codebase:
 
         codebase_path = output_path / "codebase"
 
-        # Remove the codebase directory if it exists
-        if codebase_path.exists():
-            shutil.rmtree(codebase_path)
+        if codebase_path == self._written_codebase_path and codebase_path.is_dir():
+            relative_file_paths = self._dirty_files
+        else:
+            # Read any files that have not been read yet before removing the directory, as they
+            # may be read from it (e.g., if the codebase is written back to where it was loaded)
+            self.load_files()
+
+            # Remove the codebase directory if it exists
+            if codebase_path.exists():
+                shutil.rmtree(codebase_path)
+
+            # Recreate the codebase directory
+            codebase_path.mkdir(parents=True, exist_ok=True)
+
+            relative_file_paths = self.files
+
+        file_paths = {
+            os.path.join(codebase_path, relative_file_path): self.files[relative_file_path]
+            for relative_file_path in relative_file_paths
+        }
+
+        # Create each directory once, rather than once per file
+        for directory in {os.path.dirname(file_path) for file_path in file_paths}:
+            os.makedirs(directory, exist_ok=True)
+
+        if file_paths:
+            # The files are written concurrently, as writing many small files is dominated by
+            # I/O latency. The files are not synced to disk, as the output does not need to
+            # survive a system crash.
+            max_workers = min(32, (os.cpu_count() or 1) * 4, len(file_paths))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # Consume the iterator, so that any errors are raised
+                list(
+                    executor.map(
+                        _write_file,
+                        file_paths.keys(),
+                        (source_file.contents for source_file in file_paths.values()),
+                    )
+                )
+
+        self._written_codebase_path = codebase_path
+        self._dirty_files = set()
+
+
+def _write_file(file_path: str, contents: str) -> None:
+    """
+    Write the contents of a file to disk.
+
+    The file is written with low-level `os` calls and large chunks, which avoids the overhead of
+    setting up a buffered text wrapper for every file.
+    """
+    data = memoryview(contents.encode("utf-8"))
+    fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            written = os.write(fd, data[:WRITE_CHUNK_SIZE])
+            data = data[written:]
+    finally:
+        os.close(fd)
 
-        # Recreate the codebase directory
-        codebase_path.mkdir(parents=True, exist_ok=True)
 
-        for source_file in self.files.values():
-            file_path = codebase_path / source_file.relative_file_path
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            file_path.write_text(source_file.contents)
+class SourceFile:
+    """
+    Class to represent a source file in a codebase.
 
+    Only the latest contents of the source file are kept, so that memory use does not grow with
+    the number of edits.
+    """
 
-class SourceFile:
-    """Class to represent a source file in a codebase."""
+    __slots__ = ("_relative_file_path", "_file_name", "_file_path", "_contents", "_version_count")
 
     def __init__(
         self,
         relative_file_path: str,
-        contents: str,
+        contents: str | None = None,
+        file_path: str | Path | None = None,
     ) -> None:
         """
         Initalise the SourceFile object.
@@ -109,18 +286,40 @@ class SourceFile:
         relative_file_path : str
             Path of the source file relative to the root of the codebase.
 
-        contents : str
-            The contents of the source file.
+        contents : str | None
+            The contents of the source file. Either this or `file_path` must be provided.
+
+        file_path : str | Path | None
+            Full path to the source file on disk. If `contents` is not provided, the contents
+            are read from this file the first time that they are needed.
         """
-        self._relative_file_path = relative_file_path
-        self._file_name = Path(self._relative_file_path).name
+        if contents is None and file_path is None:
+            raise ValueError("Either the contents or the file path must be provided.")
 
-        self.versions = []
-        self.versions.append(contents)
+        self._relative_file_path = relative_file_path
+        # The file name is only found the first time that it is needed
+        self._file_name: str | None = None
+        self._file_path = file_path
+
+        self._contents = contents
+        self._version_count = 1
+
+    def load(self) -> None:
+        """Read the original contents of the source file from disk, if not already read."""
+        if self._contents is None:
+            # Reading the raw bytes and decoding them avoids the overhead of a buffered text
+            # wrapper, which is significant when reading many small files. Line endings are
+            # translated as a text wrapper would, so that they are always "\n".
+            with open(self._file_path, "rb", buffering=0) as fh:
+                contents = fh.read().decode("utf-8")
+            if "\r" in contents:
+                contents = contents.replace("\r\n", "\n").replace("\r", "\n")
+            self._contents = contents
 
     def update_contents(self, contents: str) -> None:
-        """Add a new version of the source file."""
-        self.versions.append(contents)
+        """Replace the contents of the source file with a new version."""
+        self._contents = contents
+        self._version_count += 1
 
     @property
     def relative_file_path(self) -> str:
@@ -130,9 +329,23 @@ class SourceFile:
     @property
     def file_name(self) -> str:
         """The name of the source file."""
+        if self._file_name is None:
+            # The name is found with string operations, rather than by constructing a `Path`
+            self._file_name = os.path.basename(self._relative_file_path)
         return self._file_name
 
+    @property
+    def loaded(self) -> bool:
+        """Whether the contents of the source file have been read."""
+        return self._contents is not None
+
+    @property
+    def version_count(self) -> int:
+        """The number of versions of the source file, including the original."""
+        return self._version_count
+
     @property
     def contents(self) -> str:
         """The contents of the latest version of the source file."""
-        return self.versions[-1]
+        self.load()
+        return self._contents
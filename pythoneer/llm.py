@@ -1,51 +1,84 @@
 """Functions to work with Anthropic's LM API."""
 
+from __future__ import annotations
+
+import sys
 from dataclasses import dataclass
 
-from anthropic.types.message import Message
+# orjson parses JSON considerably faster than the standard library, so it is used if installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
-@dataclass
-class ToolUseResponse:
-    """Response from the Anthropic LM API."""
+@dataclass(slots=True)
+class ToolCall:
+    """A single tool use request from the Anthropic LM API."""
 
-    thought: str
     tool_id: str
     tool_name: str
     tool_arguments: dict
 
 
-def parse_tool_use_response(response: Message) -> ToolUseResponse:
+@dataclass(slots=True)
+class ToolUseResponse:
+    """Response from the Anthropic LM API."""
+
+    thought: str
+    tool_calls: list[ToolCall]
+
+
+def parse_tool_use_response(response: bytes | dict) -> ToolUseResponse:
     """
     Parse a tool use response from the Anthropic LM API.
 
+    The response is parsed from the raw JSON body of the HTTP response, rather than from the
+    SDK's `Message` model, which avoids validating and constructing a model for every block.
+
+    The response may contain more than one tool use request. Any text blocks in the response
+    are combined into the thought.
+
     Parameters
     ----------
-    response : Message
-        The response from the Anthropic LM API.
+    response : bytes | dict
+        The JSON body of the response from the Anthropic LM API, either raw or decoded.
 
     Returns
     -------
     tool_use_resposne : ToolUseResponse
         The response from the Anthropic LM API.
     """
-    stop_reason = response.stop_reason
+    if isinstance(response, bytes):
+        response = json_loads(response)
+
+    stop_reason = response["stop_reason"]
     if stop_reason != "tool_use":
         raise ValueError(f"Unexpected stop reason: {stop_reason}. Expected 'tool_use'.")
 
-    thought_block = response.content[0]
-    thought = thought_block.text
+    # The content blocks are parsed in a single pass, without assuming their order. The thought
+    # is usually a single text block before the tool uses, but may be absent or split up.
+    thoughts = []
+    tool_calls = []
+    for block in response["content"]:
+        block_type = block["type"]
+        if block_type == "text":
+            thoughts.append(block["text"])
+        elif block_type == "tool_use":
+            # The tool name is interned, as it is one of a small, fixed set of names
+            tool_calls.append(
+                ToolCall(
+                    tool_id=block["id"],
+                    tool_name=sys.intern(block["name"]),
+                    tool_arguments=block["input"],
+                )
+            )
 
-    tool_use_block = response.content[1]
-    tool_id = tool_use_block.id
-    tool_name = tool_use_block.name
-    tool_arguments = tool_use_block.input
+    thought = "\n\n".join(thoughts)
 
     tool_use_response = ToolUseResponse(
         thought=thought,
-        tool_id=tool_id,
-        tool_name=tool_name,
-        tool_arguments=tool_arguments,
+        tool_calls=tool_calls,
     )
 
     return tool_use_response
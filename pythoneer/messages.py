@@ -3,24 +3,20 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from collections import deque
 
 
 class MessageLog:
-    """Class to represent a log of messages."""
+    """
+    Class to represent a log of messages.
 
-    def __init__(self):
-        self.messages: list[Message] = []
+    The most recent messages are kept in a live window, and are shown in full. Older messages
+    are moved out of the window into an archive, and are shown summarised.
+    """
 
-    def add_message(self, message: Message):
-        """Add a message to the log."""
-        self.messages.append(message)
-
-    def return_messages_list(self, summarise_before_last: int | None = None):
+    def __init__(self, summarise_before_last: int | None = None):
         """
-        Return a list of json-formatted messages.
-
-        This is the input for the 'messages' parameter of Anthropic's language model
-        messages API. The messages alternate between user and assistant messages.
+        Initialise the MessageLog object.
 
         Parameters
         ----------
@@ -30,53 +26,86 @@ class MessageLog:
             user messages) for all messages except the last `summarise_before_last` will be
             summarised. If None, no messages will be summarised (all will be shown in full).
 
-        Returns
-        -------
-        messages_list : list[dict]
-            A list of json-formatted messages.
-
         Notes
         -----
         The most recent `summarise_before_last` messages will be shown in full, and the rest will
         be summarised. This is useful for long tasks with many messages - for efficency and to
         ensure that the agent pays most attention to the most recent messages.
         """
-        num_messages = len(self.messages)
-        if summarise_before_last is None:
-            summarise_until = 0
-        else:
-            summarise_until = num_messages - summarise_before_last
+        self.summarise_before_last = summarise_before_last
 
-        messages_list = []
+        # The most recent messages, which are shown in full
+        self.messages: deque[Message] = deque()
 
-        for num, message in enumerate(self.messages):
-            if num >= summarise_until:
-                summarised = False
-            else:
-                summarised = True
+        # The older messages, which are shown summarised
+        self.archive: list[Message] = []
 
-            if isinstance(message, InstanceMessage):
-                json_message = message.return_json_message()
-            elif isinstance(message, AssistantMessage):
-                json_message = message.return_json_message(summarised=summarised)
-            elif isinstance(message, UserMessage):
-                json_message = message.return_json_message(
-                    summarised=summarised, include_review_comment=True
-                )
-            else:
-                raise ValueError("Message type not recognised.")
+        # Json-formatted, summarised versions of the archived messages. A message never changes
+        # once it has been archived, so it is only summarised once.
+        self._summarised_messages: list[dict] = []
 
-            messages_list.append(json_message)
+        # Json-formatted, full versions of the messages in the live window, in the same order
+        self._live_messages: deque[dict] = deque()
 
-        return messages_list
+    def add_message(self, message: Message):
+        """Add a message to the log, archiving the oldest live message if the window is full."""
+        self.messages.append(message)
+        self._live_messages.append(self._return_json_message(message, summarised=False))
+
+        if (
+            self.summarise_before_last is not None
+            and len(self.messages) > self.summarise_before_last
+        ):
+            archived_message = self.messages.popleft()
+            self._live_messages.popleft()
+            self.archive.append(archived_message)
+            self._summarised_messages.append(
+                self._return_json_message(archived_message, summarised=True)
+            )
+
+    def return_messages_list(self) -> list[dict]:
+        """
+        Return a list of json-formatted messages.
+
+        This is the input for the 'messages' parameter of Anthropic's language model
+        messages API. The messages alternate between user and assistant messages.
+
+        Returns
+        -------
+        messages_list : list[dict]
+            A list of json-formatted messages. The archived messages are summarised, and the
+            messages in the live window are shown in full.
+        """
+        return [*self._summarised_messages, *self._live_messages]
+
+    @staticmethod
+    def _return_json_message(message: Message, summarised: bool) -> dict:
+        """Return a message as a JSON serialisable dictionary, summarised if specified."""
+        try:
+            handler = _JSON_MESSAGE_HANDLERS[type(message)]
+        except KeyError:
+            raise ValueError("Message type not recognised.") from None
+
+        return handler(message, summarised)
 
 
 class Message(ABC):
     """Abstract base class for messages."""
 
+    __slots__ = ("_json_messages",)
+
+    def __init__(self):
+        # Json-formatted versions of the message, keyed by the formatting options. A message
+        # never changes once it has been created, so each version is only built once.
+        self._json_messages: dict[tuple, dict] = {}
+
     @abstractmethod
     def return_json_message(self) -> dict:
-        """Return the message as a JSON serialisable dictionary."""
+        """
+        Return the message as a JSON serialisable dictionary.
+
+        The same dictionary is returned on every call, so it must not be modified.
+        """
         pass
 
 
@@ -85,7 +114,9 @@ class InstanceMessage(Message):
 
     ROLE = "user"
 
-    def __init__(self, instance_prompt: str):
+    __slots__ = ("instance_prompt", "cache")
+
+    def __init__(self, instance_prompt: str, cache: bool = True):
         """
         Initalise the InstanceMessage object.
 
@@ -93,8 +124,14 @@ class InstanceMessage(Message):
         ----------
         instance_prompt : str
             The prompt that describes the task.
+
+        cache : bool
+            Whether to mark the instance prompt for prompt caching. The instance prompt is the
+            same for every step, so it forms part of the stable prefix of every request.
         """
+        super().__init__()
         self.instance_prompt = instance_prompt
+        self.cache = cache
 
     def return_json_message(self) -> dict:
         """
@@ -107,6 +144,9 @@ class InstanceMessage(Message):
         message : dict
             The message as a JSON serialisable dictionary.
         """
+        if () in self._json_messages:
+            return self._json_messages[()]
+
         content = [
             {
                 "type": "text",
@@ -114,10 +154,14 @@ class InstanceMessage(Message):
             }
         ]
 
+        if self.cache:
+            content[0]["cache_control"] = {"type": "ephemeral"}
+
         message = {
             "role": self.ROLE,
             "content": content,
         }
+        self._json_messages[()] = message
 
         return message
 
@@ -128,6 +172,8 @@ class AssistantMessage(Message):
 
     ROLE = "assistant"
 
+    __slots__ = ("thought", "tool_id", "tool_name", "tool_arguments", "_summarised_tool_arguments")
+
     def __init__(
         self,
         thought: str,
@@ -149,13 +195,26 @@ class AssistantMessage(Message):
 
         tool_arguments : dict
         """
+        super().__init__()
         self.thought = thought
         self.tool_id = tool_id
         self.tool_name = tool_name
         self.tool_arguments = tool_arguments
-        self.summarised_tool_arguments = self.create_summarised_tool_arguments(
-            tool_name, tool_arguments
-        )
+        self._summarised_tool_arguments: dict | None = None
+
+    @property
+    def summarised_tool_arguments(self) -> dict:
+        """
+        The summarised tool arguments.
+
+        These are only created the first time that they are needed, which is when the message is
+        archived.
+        """
+        if self._summarised_tool_arguments is None:
+            self._summarised_tool_arguments = self.create_summarised_tool_arguments(
+                self.tool_name, self.tool_arguments
+            )
+        return self._summarised_tool_arguments
 
     def create_summarised_tool_arguments(self, tool_name, tool_arguments) -> dict:
         """
@@ -204,28 +263,40 @@ class AssistantMessage(Message):
         message : dict
             The message as a JSON serialisable dictionary.
         """
+        key = (summarised,)
+        if key in self._json_messages:
+            return self._json_messages[key]
+
         if summarised:
             tool_arguments = self.summarised_tool_arguments
         else:
             tool_arguments = self.tool_arguments
 
-        content = [
-            {
-                "type": "text",
-                "text": self.thought,
-            },
+        content = []
+
+        # The thought is empty for all but the first of several tool uses in a single response
+        if self.thought:
+            content.append(
+                {
+                    "type": "text",
+                    "text": self.thought,
+                }
+            )
+
+        content.append(
             {
                 "type": "tool_use",
                 "id": self.tool_id,
                 "name": self.tool_name,
                 "input": tool_arguments,
-            },
-        ]
+            }
+        )
 
         message = {
             "role": self.ROLE,
             "content": content,
         }
+        self._json_messages[key] = message
 
         return message
 
@@ -236,6 +307,14 @@ class UserMessage(Message):
 
     ROLE = "user"
 
+    __slots__ = (
+        "tool_id",
+        "observation",
+        "summarised_observation",
+        "next_step_prompt",
+        "review_comment",
+    )
+
     def __init__(
         self,
         tool_id: str,
@@ -264,6 +343,7 @@ class UserMessage(Message):
         review_comment: str | None
             A comment from the reviewer about the result.
         """
+        super().__init__()
         self.tool_id = tool_id
         self.observation = observation
         self.summarised_observation = summarised_observation
@@ -294,6 +374,10 @@ class UserMessage(Message):
         message : dict
             The message as a JSON serialisable dictionary.
         """
+        key = (summarised, include_review_comment)
+        if key in self._json_messages:
+            return self._json_messages[key]
+
         if summarised:
             tool_result_content = self.summarised_observation
         else:
@@ -326,5 +410,19 @@ class UserMessage(Message):
             "role": self.ROLE,
             "content": content,
         }
+        self._json_messages[key] = message
 
         return message
+
+
+# Mapping of message types to functions that return the message as a JSON serialisable
+# dictionary, summarised if specified
+_JSON_MESSAGE_HANDLERS = {
+    InstanceMessage: lambda message, summarised: message.return_json_message(),
+    AssistantMessage: lambda message, summarised: message.return_json_message(
+        summarised=summarised
+    ),
+    UserMessage: lambda message, summarised: message.return_json_message(
+        summarised=summarised, include_review_comment=True
+    ),
+}
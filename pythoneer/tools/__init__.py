@@ -13,7 +13,9 @@ Available tools:
 - CompleteTaskTool: For marking a task as complete
 """
 
+from .base import Tool
 from .factory import ToolFactory
+from .observations import Observation
 from .tools import (
     OpenFileTool,
     EditFileTool,
@@ -34,6 +36,8 @@ def register_all_tools():
 
 
 __all__ = [
+    "Tool",
+    "Observation",
     "ToolFactory",
     "OpenFileTool",
     "EditFileTool",
@@ -3,6 +3,9 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
+import functools
+import json
+import sys
 from dataclasses import dataclass
 from abc import ABC, abstractmethod
 
@@ -14,9 +17,13 @@ if TYPE_CHECKING:
     from pythoneer.agent import Agent
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Parameter:
-    """A parameter for a tool."""
+    """
+    A parameter for a tool.
+
+    Parameters are defined once for each tool class, and are not modified afterwards.
+    """
 
     name: str
     type: str
@@ -24,6 +31,11 @@ class Parameter:
     enum: list[str] | None = None
     required: bool = True
 
+    def __post_init__(self):
+        """Intern the name and type, as they are compared with other strings when validating."""
+        object.__setattr__(self, "name", sys.intern(self.name))
+        object.__setattr__(self, "type", sys.intern(self.type))
+
 
 class Tool(ABC):
     """
@@ -37,6 +49,53 @@ class Tool(ABC):
     PARAMETERS: list[Parameter] | None = None
     """Tool descriptors. These should be overridden in each subclass."""
 
+    INFORMATIONAL: bool = False
+    """
+    Whether the tool only retrieves information from the codebase, without modifying it or
+    running any code.
+    """
+
+    PARALLEL_SAFE: bool = False
+    """
+    Whether the tool can be used concurrently with other parallel-safe tools. This should only
+    be set for tools that do not modify the codebase or the state of the agent.
+    """
+
+    CACHEABLE: bool = False
+    """
+    Whether the observation from the tool can be reused when the tool is used again with the same
+    arguments, and the codebase has not changed. This should only be set for tools that do not
+    modify the codebase, and whose observation depends only on the arguments and the codebase
+    (i.e., not for tools that run code). Any changes that the tool makes to the state of the agent
+    must be made again by `_restore_from_cache`.
+    """
+
+    _PARAMETER_NAMES: frozenset[str] = frozenset()
+    _REQUIRED_PARAMETER_NAMES: tuple[str, ...] = ()
+    """The names of all parameters, and of the required parameters. Set for each subclass."""
+
+    _PARAMETER_TYPE_NAMES: tuple[tuple[str, str], ...] = ()
+    """
+    The name of each parameter, and the name of the Python type that its argument must have.
+    Set for each subclass.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Precompute the parameter names and types of the tool, so that validation does not rebuild
+        them.
+        """
+        super().__init_subclass__(**kwargs)
+        parameters = cls.PARAMETERS or []
+        cls._PARAMETER_NAMES = frozenset(parameter.name for parameter in parameters)
+        cls._REQUIRED_PARAMETER_NAMES = tuple(
+            parameter.name for parameter in parameters if parameter.required
+        )
+        cls._PARAMETER_TYPE_NAMES = tuple(
+            (parameter.name, "str" if parameter.type == "string" else parameter.type)
+            for parameter in parameters
+        )
+
     def __init__(self, **kwargs):
         """
         Initialise the tool.
@@ -76,6 +135,14 @@ class Tool(ABC):
         observation : Observation
             An observation after using the tool.
         """
+        if self.CACHEABLE:
+            cache_key = self._cache_key(agent)
+            observation = agent.tool_observation_cache.get(cache_key)
+            if observation is not None:
+                logger.info(f"♻️ Using cached observation for the '{self.NAME}' tool.")
+                self._restore_from_cache(agent, observation)
+                return observation
+
         try:
             self.validate_arguments(agent)
         except ValueError as exc:
@@ -89,9 +156,50 @@ class Tool(ABC):
             )
         else:
             observation = self._use(agent)
+            if self.CACHEABLE:
+                agent.tool_observation_cache.set(cache_key, observation)
 
         return observation
 
+    def _cache_key(self, agent: Agent) -> tuple[str, str, int]:
+        """The key to cache the observation from the tool under."""
+        arguments = json.dumps(self.arguments, sort_keys=True)
+        return self.NAME, arguments, agent.codebase.version
+
+    def _restore_from_cache(self, agent: Agent, observation: Observation) -> None:
+        """
+        Make the changes to the state of the agent that using the tool would have made, when a
+        cached observation is used instead.
+
+        This method should be overridden by cacheable subclasses that change the state of the
+        agent (e.g., the file open in the file editor).
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent using the tool.
+
+        observation : Observation
+            The cached observation.
+        """
+        pass
+
+    @classmethod
+    def prepare(cls, agent: Agent) -> None:
+        """
+        Prepare the tool for use. Called once for each of the agent's tools, when the agent is
+        created.
+
+        This method can be overridden by subclasses to start slow setup (e.g., starting a Docker
+        container) in the background, so that it is done by the time that the tool is first used.
+
+        Parameters
+        ----------
+        agent : Agent
+            The agent that will use the tool.
+        """
+        pass
+
     @abstractmethod
     def _use(self, agent) -> Observation:
         """
@@ -110,12 +218,16 @@ class Tool(ABC):
         pass
 
     @classmethod
+    @functools.cache
     def json_description(cls) -> dict:
         """
         The JSON-format description for the tool.
 
         This is provided to the large language model. Currently, the returned
         schema is suitable only for Anthropic's LM API.
+
+        The description is only built once for each tool class, and the same dictionary is
+        returned on every call, so it must not be modified.
         """
         properties = {}
         for parameter in cls.PARAMETERS:
@@ -128,7 +240,7 @@ class Tool(ABC):
             if parameter.enum:
                 properties[name]["enum"] = parameter.enum
 
-        required = [parameter.name for parameter in cls.PARAMETERS if parameter.required]
+        required = list(cls._REQUIRED_PARAMETER_NAMES)
 
         description = {
             "name": cls.NAME,
@@ -163,28 +275,26 @@ class Tool(ABC):
 
     def _validate_all_parameters_present(self):
         """Validate that all required parameters are present."""
-        for parameter in self.PARAMETERS:
-            if parameter.required and parameter.name not in self.arguments:
+        for parameter_name in self._REQUIRED_PARAMETER_NAMES:
+            if parameter_name not in self.arguments:
                 raise ValueError(
-                    f"Tool {type(self).__name__} is missing required argument: {parameter.name}"
+                    f"Tool {type(self).__name__} is missing required argument: {parameter_name}"
                 )
 
     def _validate_argument_types(self):
         """Validate that the provided arguments have the correct types."""
-        for parameter in self.PARAMETERS:
-            if parameter.name in self.arguments:
-                expected_type = parameter.type
-                if expected_type == "string":
-                    expected_type = "str"
-                actual_type = type(self.arguments[parameter.name]).__name__
+        arguments = self.arguments
+        for parameter_name, expected_type in self._PARAMETER_TYPE_NAMES:
+            if parameter_name in arguments:
+                actual_type = type(arguments[parameter_name]).__name__
                 if actual_type != expected_type:
                     raise ValueError(
-                        f"Invalid argument type for {parameter.name}. "
+                        f"Invalid argument type for {parameter_name}. "
                         f"Expected {expected_type}, got {actual_type}."
                     )
 
     def _warn_unused_arguments(self):
         """Warn if any arguments are not used."""
         for argument in self.arguments:
-            if argument not in [parameter.name for parameter in self.PARAMETERS]:
+            if argument not in self._PARAMETER_NAMES:
                 logger.warning(f"Unused argument: '{argument}' provided to '{self.NAME}' tool.")
@@ -1,7 +1,17 @@
 """Tool factory for creating tools."""
 
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 from pythoneer.tools.base import Tool
 
+if TYPE_CHECKING:
+    from pythoneer.agent import Agent
+    from pythoneer.tools.observations import Observation
+
 
 class ToolFactory:
     """A factory for creating tools."""
@@ -44,3 +54,38 @@ class ToolFactory:
 
         tool_instance = tool_class(**kwargs)
         return tool_instance
+
+    @staticmethod
+    def use_many(
+        tools: list[Tool], agent: Agent, max_workers: int | None = None
+    ) -> list[Observation]:
+        """
+        Use several independent tools concurrently.
+
+        The tools are used in a pool of threads. Most of the time spent using a tool is spent
+        waiting for a subprocess (e.g., a command in a Docker container), so the tools run in
+        parallel. Only tools that do not modify the codebase or the state of the agent should be
+        used together (see `Tool.PARALLEL_SAFE`).
+
+        Parameters
+        ----------
+        tools : list[Tool]
+            The tools to use.
+
+        agent : Agent
+            The agent using the tools.
+
+        max_workers : int | None
+            The maximum number of tools to use at once. Defaults to the number of CPUs.
+
+        Returns
+        -------
+        observations : list[Observation]
+            The observations after using each tool, in the same order as the tools.
+        """
+        if len(tools) == 1:
+            return [tools[0].use(agent)]
+
+        max_workers = min(max_workers or os.cpu_count() or 1, len(tools))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda tool: tool.use(agent), tools))
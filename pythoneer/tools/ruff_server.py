@@ -0,0 +1,253 @@
+"""Module containing a client for a long-running Ruff language server."""
+
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# orjson parses JSON considerably faster than the standard library, so it is used if installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+
+class RuffServer:
+    """
+    Client for a long-running `ruff server` process, which lints code over the Language Server
+    Protocol (LSP).
+
+    Starting a new Ruff process for every lint is slow compared to linting a single file, so the
+    server is started the first time that it is needed, and is then reused. The server is shut
+    down when the client is closed, or when the process exits.
+
+    Each request to the server must be answered within a timeout, so that a server that stops
+    responding cannot block linting. The server is then killed, and restarted on the next call.
+    """
+
+    REQUEST_TIMEOUT = 10
+    """Maximum number of seconds to wait for the server to accept and answer a request."""
+
+    def __init__(self) -> None:
+        """Initialise the RuffServer object."""
+        self._process: subprocess.Popen | None = None
+        self._request_id = 0
+
+        # Output received from the server that has not been parsed into messages yet
+        self._buffer = bytearray()
+
+        # Held while using the server, as only one document is linted at a time
+        self._lock = threading.Lock()
+
+        # An empty workspace directory, so that no project configuration is picked up
+        self._workspace_path: Path | None = None
+
+        atexit.register(self.close)
+
+    def check(self, code_string: str) -> list[tuple[int, int, str | None, str]]:
+        """
+        Lint a code string.
+
+        Parameters
+        ----------
+        code_string : str
+            The code string to lint.
+
+        Returns
+        -------
+        violations : list[tuple[int, int, str | None, str]]
+            The violations found, as (row, column, code, message) tuples. The rows and columns
+            start from 1.
+
+        Raises
+        ------
+        RuntimeError
+            If the server exits unexpectedly, or does not respond in time. The server is
+            restarted on the next call.
+        """
+        with self._lock:
+            try:
+                if self._process is None:
+                    self._start()
+                return self._check(code_string)
+            except (OSError, RuntimeError, ValueError) as exc:
+                self._kill()
+                raise RuntimeError(f"The Ruff server failed: {exc}") from exc
+
+    def _check(self, code_string: str) -> list[tuple[int, int, str | None, str]]:
+        """Open the code as a document, request its diagnostics, and then close it."""
+        text_document = {"uri": (self._workspace_path / "snippet.py").as_uri()}
+
+        self._notify(
+            "textDocument/didOpen",
+            {
+                "textDocument": {
+                    **text_document,
+                    "languageId": "python",
+                    "version": 1,
+                    "text": code_string,
+                }
+            },
+        )
+        result = self._request("textDocument/diagnostic", {"textDocument": text_document})
+        self._notify("textDocument/didClose", {"textDocument": text_document})
+
+        violations = []
+        for diagnostic in result["items"]:
+            start = diagnostic["range"]["start"]
+            # The server appends suggested fixes to the message, which `ruff check` does not
+            message = diagnostic["message"].split("\n\n", 1)[0]
+            violations.append(
+                (start["line"] + 1, start["character"] + 1, diagnostic.get("code"), message)
+            )
+
+        return violations
+
+    def _start(self) -> None:
+        """Start the server, and initialise the LSP session."""
+        self._workspace_path = Path(tempfile.mkdtemp(prefix="pythoneer-ruff-"))
+        self._process = subprocess.Popen(
+            ["ruff", "server"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        # The pipes are read and written directly, and never block, so that the time spent on
+        # them can be limited
+        os.set_blocking(self._process.stdin.fileno(), False)
+        os.set_blocking(self._process.stdout.fileno(), False)
+
+        self._request(
+            "initialize",
+            {
+                "processId": os.getpid(),
+                "rootUri": None,
+                "workspaceFolders": [{"uri": self._workspace_path.as_uri(), "name": "pythoneer"}],
+                "capabilities": {
+                    # Columns are counted in characters, as they are by `ruff check`
+                    "general": {"positionEncodings": ["utf-32"]},
+                    "textDocument": {"diagnostic": {}},
+                },
+            },
+        )
+        self._notify("initialized", {})
+
+    def _request(self, method: str, params: dict) -> dict:
+        """Send a request to the server, and wait for the result."""
+        self._request_id += 1
+        request_id = self._request_id
+        deadline = time.monotonic() + self.REQUEST_TIMEOUT
+        self._send(
+            {"jsonrpc": "2.0", "id": request_id, "method": method, "params": params}, deadline
+        )
+
+        while True:
+            message = self._receive(deadline)
+            if message.get("id") == request_id and "method" not in message:
+                if "error" in message:
+                    raise RuntimeError(message["error"].get("message", "Unknown error."))
+                return message["result"]
+            if "id" in message and "method" in message:
+                # Requests from the server (e.g., to report progress) are acknowledged, but
+                # otherwise ignored. Notifications (e.g., pushed diagnostics) are ignored.
+                self._send({"jsonrpc": "2.0", "id": message["id"], "result": None}, deadline)
+
+    def _notify(self, method: str, params: dict) -> None:
+        """Send a notification to the server."""
+        deadline = time.monotonic() + self.REQUEST_TIMEOUT
+        self._send({"jsonrpc": "2.0", "method": method, "params": params}, deadline)
+
+    def _send(self, message: dict, deadline: float) -> None:
+        """Send a message to the server, framed with a Content-Length header."""
+        body = json.dumps(message).encode("utf-8")
+        data = memoryview(f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body)
+
+        stdin_fd = self._process.stdin.fileno()
+        while data:
+            self._wait(stdin_fd, deadline, write=True)
+            try:
+                written = os.write(stdin_fd, data)
+            except BlockingIOError:
+                continue
+            data = data[written:]
+
+    def _receive(self, deadline: float) -> dict:
+        """Receive a single message from the server."""
+        while (header_end := self._buffer.find(b"\r\n\r\n")) == -1:
+            self._read(deadline)
+
+        content_length = None
+        for line in self._buffer[:header_end].decode("ascii").split("\r\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-length":
+                content_length = int(value)
+
+        if content_length is None:
+            raise RuntimeError("Received a message from the Ruff server without a length.")
+
+        message_end = header_end + 4 + content_length
+        while len(self._buffer) < message_end:
+            self._read(deadline)
+
+        body = bytes(self._buffer[header_end + 4 : message_end])
+        del self._buffer[:message_end]
+        return json_loads(body)
+
+    def _read(self, deadline: float) -> None:
+        """Read the available output from the server into the buffer."""
+        stdout_fd = self._process.stdout.fileno()
+        self._wait(stdout_fd, deadline, write=False)
+        try:
+            data = os.read(stdout_fd, 65536)
+        except BlockingIOError:
+            return
+        if not data:
+            raise RuntimeError("The Ruff server closed its output.")
+        self._buffer += data
+
+    @staticmethod
+    def _wait(fd: int, deadline: float, write: bool) -> None:
+        """Wait until a pipe to the server is ready, or raise an error if the deadline passes."""
+        timeout = deadline - time.monotonic()
+        if timeout > 0:
+            if write:
+                ready = select.select([], [fd], [], timeout)[1]
+            else:
+                ready = select.select([fd], [], [], timeout)[0]
+            if ready:
+                return
+
+        raise RuntimeError("The Ruff server did not respond in time.")
+
+    def close(self) -> None:
+        """Shut down the server."""
+        with self._lock:
+            if self._process is not None:
+                try:
+                    self._request("shutdown", None)
+                    self._notify("exit", None)
+                    self._process.wait(timeout=5)
+                except (OSError, RuntimeError, ValueError, subprocess.TimeoutExpired):
+                    pass
+            self._kill()
+
+    def _kill(self) -> None:
+        """Kill the server process if it is still running, and remove the workspace directory."""
+        if self._process is not None:
+            if self._process.poll() is None:
+                self._process.kill()
+                self._process.wait()
+            self._process = None
+        self._buffer.clear()
+
+        if self._workspace_path is not None:
+            shutil.rmtree(self._workspace_path, ignore_errors=True)
+            self._workspace_path = None
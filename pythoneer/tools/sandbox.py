@@ -0,0 +1,662 @@
+"""Module containing a sandbox of Docker containers for the agent to run code in."""
+
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+import atexit
+import contextlib
+import csv
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+
+if TYPE_CHECKING:
+    from pythoneer.codebase import Codebase
+
+SHARED_MEMORY_PATH = Path("/dev/shm")
+"""Memory-backed (tmpfs) directory, available on most Linux systems."""
+
+
+@dataclass(slots=True)
+class CommandResult:
+    """
+    Class to represent the result of a command run in the sandbox.
+
+    Parameters
+    ----------
+    returncode : int
+        The exit code of the command.
+
+    stdout : str
+        The standard output of the command.
+
+    stderr : str
+        The standard error of the command.
+
+    timed_out : bool
+        Whether the command was stopped because it timed out.
+    """
+
+    returncode: int
+    stdout: str
+    stderr: str
+    timed_out: bool = False
+
+
+class DockerSandbox:
+    """
+    Class to represent a sandbox of Docker containers for the agent to run code in.
+
+    Starting a container is slow, so a container is started for each image the first time that
+    it is needed, and is then reused for every command run with that image. The containers share
+    a scratch directory on the host, which is mounted at `/workspace` in each container, and that
+    the codebase is written to before running a command. Commands can change the files in the
+    scratch directory, so the codebase directory is restored to match the codebase before each
+    command, as if it had been written to a new directory.
+
+    The scratch directory is created in memory (tmpfs) when available, as the codebase is written
+    to it before every command. The pip cache and the installed packages can be large, so they
+    are kept in a separate directory on disk, which is mounted inside `/workspace`.
+
+    The containers are removed when the sandbox is closed, or when the process exits.
+    """
+
+    INSTALL_COMMAND = (
+        "pip install --no-warn-script-location --no-python-version-warning "
+        "--disable-pip-version-check --user -q ."
+    )
+    """
+    Command to install the codebase. The codebase is installed as a regular (not editable)
+    package, and edits to its source files are copied over the installed copies.
+    """
+
+    PACKAGING_FILES = ("pyproject.toml", "setup.py", "setup.cfg")
+    """
+    Files that define how the codebase is installed. The codebase is installed again when one of
+    these files changes, or when a file is added to the codebase.
+    """
+
+    CODEBASE_URL = "file:///workspace/codebase"
+    """URL that pip records for distributions installed from the codebase directory."""
+
+    PACKAGES_SUBDIRECTORIES = ("pip_cache", "local")
+    """Directories for the pip cache and the user site-packages, which are kept on disk."""
+
+    TIMEOUT_EXIT_CODES = (124, 137)
+    """
+    Exit codes of `timeout` when it stops a command that timed out, after terminating it, or
+    after having to kill it.
+    """
+
+    DOCKER_TIMEOUT_EXIT_CODE = -9
+    """
+    Exit code of a command whose `docker exec` was killed, as Docker stopped responding. This is
+    the exit code that `subprocess` reports for a process killed with SIGKILL.
+    """
+
+    KILL_AFTER = 10
+    """Number of seconds to wait for a command that timed out to stop, before killing it."""
+
+    def __init__(self) -> None:
+        """Initialise the DockerSandbox object."""
+        scratch_root = SHARED_MEMORY_PATH if SHARED_MEMORY_PATH.is_dir() else None
+        self.directory = Path(tempfile.mkdtemp(prefix="pythoneer-sandbox-", dir=scratch_root))
+
+        # Create directories on disk for the pip cache and user site-packages, and the points in
+        # the scratch directory that they are mounted at
+        self.packages_directory = Path(tempfile.mkdtemp(prefix="pythoneer-packages-"))
+        for name in self.PACKAGES_SUBDIRECTORIES:
+            (self.packages_directory / name).mkdir()
+            (self.directory / name).mkdir()
+
+        # Mapping of (image, gpus) to the IDs of the running containers
+        self._containers: dict[tuple[str, bool], str] = {}
+
+        # The codebase that was most recently written, its ID and version, and a hash of what
+        # determines how it is installed: its packaging files, and the paths of all of its files
+        self._codebase: Codebase | None = None
+        self._written_codebase: tuple[int, int] | None = None
+        self._install_hash = ""
+
+        # Mapping of container IDs to the install hash of the codebase installed in the
+        # container, and to the version counts of the source files that were installed
+        self._installed_hashes: dict[str, str] = {}
+        self._installed_versions: dict[str, dict[str, int]] = {}
+
+        # Mapping of the relative paths of source files to the paths on the host of their
+        # installed copies, or None if where they are installed is not known
+        self._installed_file_paths: dict[str, list[Path]] | None = None
+
+        # Mapping of the relative paths of the files in the codebase directory to their size and
+        # modification time when they were last written or checked, so that unchanged files are
+        # not read again
+        self._file_stats: dict[str, tuple[int, int]] = {}
+
+        # The number of commands that are running, and a condition that is notified whenever one
+        # finishes. The files in the codebase directory are only changed when none are running.
+        self._running_commands = 0
+        self._commands_condition = threading.Condition()
+
+        # Whether the sandbox has been closed, so that containers are no longer started
+        self._closed = False
+
+        # Held while writing the codebase, starting containers, or installing the codebase, so
+        # that commands can otherwise be run concurrently. The lock is reentrant, as a container
+        # can be removed while installing the codebase in it.
+        self._lock = threading.RLock()
+
+        atexit.register(self.close)
+
+    def write_codebase(self, codebase: Codebase) -> None:
+        """
+        Write the codebase to the scratch directory, at `/workspace/codebase`.
+
+        Only the files that have changed since the codebase was last written are written, and
+        then any changes that commands have made to the directory since are undone. Files are
+        only changed while no command is running, so this waits for any running commands that
+        the changes would affect.
+        """
+        with self._lock:
+            written_codebase = (id(codebase), codebase.version)
+            if written_codebase == self._written_codebase:
+                # The directory is first checked while commands can still be running, so that
+                # they are only waited for if there are changes to undo
+                try:
+                    changes_found = any(self._find_codebase_changes(codebase))
+                except FileNotFoundError:
+                    # A running command removed a file while the directory was being checked
+                    changes_found = True
+
+                if not changes_found:
+                    return
+
+            with self._no_commands_running():
+                if written_codebase != self._written_codebase:
+                    if self._written_codebase and written_codebase[0] != self._written_codebase[0]:
+                        self._file_stats = {}
+                    codebase.write_codebase_to_disk(self.directory)
+                    self._codebase = codebase
+                    self._written_codebase = written_codebase
+                    self._install_hash = self._hash_install(codebase)
+
+                self._restore_codebase(codebase, *self._find_codebase_changes(codebase))
+
+    def _hash_install(self, codebase: Codebase) -> str:
+        """Hash the packaging files of the codebase, and the paths of all of its files."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str(id(codebase)).encode())
+        for relative_file_path in sorted(codebase.get_relative_file_paths()):
+            digest.update(b"\0" + relative_file_path.encode())
+            if relative_file_path in self.PACKAGING_FILES:
+                digest.update(b"\0" + codebase.retrieve_file(relative_file_path).contents.encode())
+        return digest.hexdigest()
+
+    def _find_codebase_changes(
+        self, codebase: Codebase
+    ) -> tuple[list[tuple[str, bool]], list[str]]:
+        """
+        Find the changes that commands have made to the codebase directory.
+
+        Only the metadata of most files is read: a source file is only read if its size or
+        modification time differs from when it was last written or checked. Cached bytecode is
+        kept, as Python checks that it matches the source file before using it.
+
+        Returns
+        -------
+        removed_paths : list[tuple[str, bool]]
+            The full path of each file or directory that is not part of the codebase, and whether
+            it is a directory.
+
+        changed_files : list[str]
+            The relative paths of the source files that have been changed or removed.
+        """
+        codebase_path = self.directory / "codebase"
+
+        # The directories that contain at least one source file
+        source_directories = set()
+        for relative_file_path in codebase.get_relative_file_paths():
+            directory = os.path.dirname(relative_file_path)
+            while directory and directory not in source_directories:
+                source_directories.add(directory)
+                directory = os.path.dirname(directory)
+
+        removed_paths = []
+        changed_files = []
+        found_files = set()
+        directories = [(str(codebase_path), "")]
+        while directories:
+            directory, relative_directory = directories.pop()
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_directory, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        if relative_path in source_directories:
+                            directories.append((entry.path, relative_path))
+                        elif entry.name != "__pycache__":
+                            removed_paths.append((entry.path, True))
+                    elif codebase.contains_file(relative_path) and entry.is_file(
+                        follow_symlinks=False
+                    ):
+                        found_files.add(relative_path)
+                        stat = entry.stat(follow_symlinks=False)
+                        file_stat = (stat.st_size, stat.st_mtime_ns)
+                        if self._file_stats.get(relative_path) == file_stat:
+                            continue
+
+                        contents = codebase.retrieve_file(relative_path).contents.encode("utf-8")
+                        if stat.st_size == len(contents):
+                            with open(entry.path, "rb") as fh:
+                                unchanged = fh.read() == contents
+                        else:
+                            unchanged = False
+
+                        if unchanged:
+                            self._file_stats[relative_path] = file_stat
+                        else:
+                            changed_files.append(relative_path)
+                    else:
+                        removed_paths.append((entry.path, False))
+
+        for relative_file_path in codebase.get_relative_file_paths():
+            if relative_file_path not in found_files:
+                changed_files.append(relative_file_path)
+
+        return removed_paths, changed_files
+
+    def _restore_codebase(
+        self,
+        codebase: Codebase,
+        removed_paths: list[tuple[str, bool]],
+        changed_files: list[str],
+    ) -> None:
+        """
+        Undo the changes that commands have made to the codebase directory, by removing the paths
+        that are not part of the codebase, and writing the changed source files again.
+        """
+        for path, is_directory in removed_paths:
+            if is_directory:
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+
+        codebase_path = self.directory / "codebase"
+        for relative_file_path in changed_files:
+            file_path = codebase_path / relative_file_path
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            file_path.write_bytes(
+                codebase.retrieve_file(relative_file_path).contents.encode("utf-8")
+            )
+            stat = file_path.stat()
+            self._file_stats[relative_file_path] = (stat.st_size, stat.st_mtime_ns)
+
+    @contextlib.contextmanager
+    def _command_running(self) -> Iterator[None]:
+        """Context manager to mark a command as running while in the context."""
+        with self._commands_condition:
+            self._running_commands += 1
+        try:
+            yield
+        finally:
+            with self._commands_condition:
+                self._running_commands -= 1
+                self._commands_condition.notify_all()
+
+    @contextlib.contextmanager
+    def _no_commands_running(self) -> Iterator[None]:
+        """
+        Context manager that waits until no commands are running, and then stops any commands
+        from starting while in the context.
+        """
+        with self._commands_condition:
+            self._commands_condition.wait_for(lambda: self._running_commands == 0)
+            yield
+
+    def start_container_in_background(self, image: str, gpus: bool = False) -> None:
+        """
+        Start the container for an image in a background thread, so that it is ready by the time
+        that it is first needed.
+
+        If the container fails to start, it is started again when it is first needed.
+        """
+        thread = threading.Thread(target=self._start_container_early, args=(image, gpus))
+        thread.daemon = True
+        thread.start()
+
+    def _start_container_early(self, image: str, gpus: bool) -> None:
+        """Start the container for an image, unless the sandbox has been closed."""
+        with self._lock:
+            if self._closed:
+                return
+
+            try:
+                self._get_container(image, gpus)
+            except (OSError, subprocess.CalledProcessError) as exc:
+                logger.warning(f"Failed to start a container for the '{image}' image: {exc}")
+
+    def execute(
+        self,
+        image: str,
+        command: str,
+        gpus: bool = False,
+        install: bool = False,
+        timeout: int | None = None,
+    ) -> CommandResult:
+        """
+        Run a command in the container for an image, starting the container if needed.
+
+        Parameters
+        ----------
+        image : str
+            The Docker image to run the command with.
+
+        command : str
+            The bash command to run. The command is run from `/workspace/codebase`.
+
+        gpus : bool
+            Whether the container should have access to the GPUs.
+
+        install : bool
+            Whether the codebase must be installed before running the command. The codebase is
+            only installed if it has not already been installed in the container, or if it has
+            changed since. If the installation fails, the command is not run, and the result of
+            the installation is returned instead.
+
+        timeout : int | None
+            The maximum number of seconds that the command can run for. If the command times
+            out, it is stopped, and the result is marked as timed out. The installation of the
+            codebase is given the same timeout. If None, the command can run for any length of
+            time.
+
+        Returns
+        -------
+        result : CommandResult
+            The result of the command, with the output captured as strings.
+        """
+        with self._lock:
+            container_id = self._get_container(image, gpus)
+
+            if install and self._codebase is not None:
+                result = self._install_codebase(container_id, self._codebase, timeout)
+                if result is not None:
+                    return result
+
+        return self._exec(container_id, command, timeout)
+
+    def _install_codebase(
+        self, container_id: str, codebase: Codebase, timeout: int | None
+    ) -> CommandResult | None:
+        """
+        Install the codebase in a container, if needed, and return the result of the installation
+        if it failed.
+
+        The codebase is only installed again if its packaging files have changed, or files have
+        been added to it, since it was last installed in the container. Otherwise, the source
+        files that have been edited since are copied over their installed copies.
+        """
+        if self._installed_hashes.get(container_id) == self._install_hash:
+            if self._update_installed_files(container_id, codebase):
+                return None
+
+        result = self._exec(container_id, self.INSTALL_COMMAND, timeout)
+        if result.returncode != 0:
+            # The previous installation may have been partly replaced
+            self._installed_hashes.pop(container_id, None)
+            return result
+
+        self._installed_hashes[container_id] = self._install_hash
+        self._installed_versions[container_id] = {
+            relative_file_path: codebase.retrieve_file(relative_file_path).version_count
+            for relative_file_path in codebase.get_relative_file_paths()
+        }
+        self._installed_file_paths = self._find_installed_files(codebase)
+        return None
+
+    def _update_installed_files(self, container_id: str, codebase: Codebase) -> bool:
+        """
+        Copy the source files that have been edited since the codebase was installed in a
+        container over their installed copies.
+
+        Returns False if where the files are installed is not known, in which case the codebase
+        must be installed again.
+        """
+        if self._installed_file_paths is None:
+            return False
+
+        installed_versions = self._installed_versions[container_id]
+        edited_files = [
+            relative_file_path
+            for relative_file_path in codebase.get_relative_file_paths()
+            if installed_versions.get(relative_file_path)
+            != codebase.retrieve_file(relative_file_path).version_count
+        ]
+        if not edited_files:
+            return True
+
+        # Containers share the installed packages, so they are only changed when no command is
+        # running
+        with self._no_commands_running():
+            for relative_file_path in edited_files:
+                source_file = codebase.retrieve_file(relative_file_path)
+                for installed_path in self._installed_file_paths.get(relative_file_path, ()):
+                    try:
+                        installed_path.write_bytes(source_file.contents.encode("utf-8"))
+                    except OSError:
+                        return False
+
+                    # Remove the bytecode compiled at installation, as it is only checked against
+                    # the modification time of the source file to the second
+                    installed_path.with_suffix(".pyc").unlink(missing_ok=True)
+                    for bytecode_path in installed_path.parent.glob(
+                        f"__pycache__/{installed_path.stem}.*.pyc"
+                    ):
+                        bytecode_path.unlink(missing_ok=True)
+                installed_versions[relative_file_path] = source_file.version_count
+
+        return True
+
+    def _find_installed_files(self, codebase: Codebase) -> dict[str, list[Path]] | None:
+        """
+        Find the installed copies of the source files of the codebase, from the records of the
+        distributions that were installed from the codebase directory.
+
+        Returns
+        -------
+        installed_file_paths : dict[str, list[Path]] | None
+            Mapping of the relative paths of source files to the paths on the host of their
+            installed copies. None if an installed module cannot be matched to a single source
+            file, or if pip did not record where the codebase was installed from.
+        """
+        # Source files by name, to match installed modules against
+        source_files_by_name: dict[str, list[str]] = {}
+        for relative_file_path in codebase.get_relative_file_paths():
+            file_name = os.path.basename(relative_file_path)
+            source_files_by_name.setdefault(file_name, []).append(relative_file_path)
+
+        installed_file_paths: dict[str, list[Path]] = {}
+        found_distribution = False
+        for direct_url_path in self.packages_directory.glob(
+            "local/lib/python*/site-packages/*.dist-info/direct_url.json"
+        ):
+            try:
+                url = json.loads(direct_url_path.read_text()).get("url")
+                if url != self.CODEBASE_URL:
+                    continue
+                with open(direct_url_path.parent / "RECORD", newline="") as fh:
+                    records = list(csv.reader(fh))
+            except (OSError, ValueError):
+                return None
+
+            found_distribution = True
+            site_packages_path = direct_url_path.parent.parent
+            for record in records:
+                installed_file = record[0] if record else ""
+                if not installed_file.endswith(".py") or ".." in installed_file.split("/"):
+                    continue
+
+                # The module is installed at the same path as its source file, relative to the
+                # root of the codebase or to a package directory (e.g., 'src')
+                matches = [
+                    relative_file_path
+                    for relative_file_path in source_files_by_name.get(
+                        os.path.basename(installed_file), []
+                    )
+                    if relative_file_path == installed_file
+                    or relative_file_path.endswith("/" + installed_file)
+                ]
+                if installed_file in matches:
+                    matches = [installed_file]
+                if len(matches) != 1:
+                    return None
+
+                installed_file_paths.setdefault(matches[0], []).append(
+                    site_packages_path / installed_file
+                )
+
+        return installed_file_paths if found_distribution else None
+
+    def _exec(self, container_id: str, command: str, timeout: int | None = None) -> CommandResult:
+        """
+        Run a command in a container, and capture the output.
+
+        If a timeout is given, the command is stopped inside the container when it runs for
+        longer, as stopping `docker exec` would leave it running. The command is killed if it
+        does not stop soon after being terminated.
+        """
+        if timeout is None:
+            deadline = None
+        else:
+            command = (
+                f"timeout --kill-after={self.KILL_AFTER} {timeout} bash -c {shlex.quote(command)}"
+            )
+            # Docker is also given a deadline, in case it stops responding
+            deadline = timeout + self.KILL_AFTER + 30
+
+        args = ["docker", "exec", container_id, "bash", "-c", command]
+
+        start_time = time.monotonic()
+        try:
+            with self._command_running():
+                process = subprocess.run(
+                    args,
+                    capture_output=True,
+                    encoding="utf-8",
+                    errors="replace",
+                    timeout=deadline,
+                )
+        except subprocess.TimeoutExpired as exc:
+            # Killing `docker exec` leaves the command running in the container, so the container
+            # is removed, and a new one is started the next time that it is needed
+            logger.warning(
+                f"Docker did not respond within {deadline} seconds, so the container "
+                f"'{container_id}' is being removed."
+            )
+            self._remove_container(container_id)
+
+            # The captured output is always bytes when the command times out
+            stderr = (exc.stderr or b"").decode("utf-8", errors="replace")
+            note = "Docker stopped responding, so the container was removed."
+            return CommandResult(
+                returncode=self.DOCKER_TIMEOUT_EXIT_CODE,
+                stdout=(exc.stdout or b"").decode("utf-8", errors="replace"),
+                stderr=f"{stderr}\n{note}" if stderr else note,
+                timed_out=True,
+            )
+        elapsed_time = time.monotonic() - start_time
+
+        # The command can exit with the same codes as `timeout` by itself, but only `timeout`
+        # can do so after the command has run for the whole timeout
+        timed_out = (
+            timeout is not None
+            and process.returncode in self.TIMEOUT_EXIT_CODES
+            and elapsed_time >= timeout
+        )
+
+        return CommandResult(process.returncode, process.stdout, process.stderr, timed_out)
+
+    def _remove_container(self, container_id: str) -> None:
+        """Remove a container, so that a new one is started the next time that it is needed."""
+        with self._lock:
+            for key, running_container_id in list(self._containers.items()):
+                if running_container_id == container_id:
+                    del self._containers[key]
+            self._installed_hashes.pop(container_id, None)
+            self._installed_versions.pop(container_id, None)
+
+        try:
+            subprocess.run(
+                ["docker", "rm", "--force", container_id],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=30,
+            )
+        except subprocess.TimeoutExpired:
+            logger.warning(f"Failed to remove the container '{container_id}'.")
+
+    def _get_container(self, image: str, gpus: bool) -> str:
+        """Return the ID of the container for an image, starting the container if needed."""
+        key = (image, gpus)
+        if key not in self._containers:
+            self._containers[key] = self._start_container(image, gpus)
+        return self._containers[key]
+
+    def _start_container(self, image: str, gpus: bool) -> str:
+        """Start a long-running container for an image, and return its ID."""
+        logger.info(f"🐳 Starting a container for the '{image}' image.")
+
+        command = ["docker", "run", "--detach", "--rm"]
+        if gpus:
+            command += ["--gpus", "all"]
+        command += [
+            "--user",
+            f"{os.getuid()}:{os.getgid()}",
+            "-v",
+            f"{self.directory}:/workspace",
+        ]
+        for name in self.PACKAGES_SUBDIRECTORIES:
+            command += ["-v", f"{self.packages_directory / name}:/workspace/{name}"]
+        command += [
+            "-w",
+            "/workspace/codebase",
+            "-e",
+            "HOME=/workspace",
+            "-e",
+            "PIP_CACHE_DIR=/workspace/pip_cache",
+            "-e",
+            "PYTHONUSERBASE=/workspace/local",
+            image,
+            "sleep",
+            "infinity",
+        ]
+
+        process = subprocess.run(command, check=True, capture_output=True, text=True)
+        return process.stdout.strip()
+
+    def close(self) -> None:
+        """Remove the containers, the scratch directory, and the packages directory."""
+        # Wait for any container that is being started in the background
+        with self._lock:
+            self._closed = True
+
+            if self._containers:
+                subprocess.run(
+                    ["docker", "rm", "--force", *self._containers.values()],
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+                self._containers = {}
+                self._installed_hashes = {}
+                self._installed_versions = {}
+
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.rmtree(self.packages_directory, ignore_errors=True)
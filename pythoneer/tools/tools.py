@@ -3,15 +3,11 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 
-import os
 import re
-import subprocess
-import tempfile
-from pathlib import Path
 
 from pythoneer.tools.observations import Observation
 from pythoneer.tools.base import Tool, Parameter
-from pythoneer.tools.utils import lint_code
+from pythoneer.tools.utils import lint_code, strip_code_fences, truncate_output
 
 
 if TYPE_CHECKING:
@@ -35,12 +31,16 @@ class OpenFileTool(Tool):
             description="The full path to the file to open. e.g., 'data/processing.py'",
         )
     ]
+    INFORMATIONAL = True
+
+    # The observation only depends on the contents of the file
+    CACHEABLE = True
 
     def _validate_argument_values(self, agent: Agent):
         """Check that the file exists in the codebase."""
         file_path = self.arguments["file_path"]
 
-        if file_path not in agent.codebase.get_relative_file_paths():
+        if not agent.codebase.contains_file(file_path):
             raise ValueError(
                 f"The file '{file_path}' does not exist in the codebase. "
                 f"The files in the codebase are:\n{agent.codebase.formatted_relative_file_paths()}"
@@ -49,9 +49,7 @@ class OpenFileTool(Tool):
     def _use(self, agent: Agent) -> Observation:
         """Open the file."""
         file_path = self.arguments["file_path"]
-        agent.open_file_relative_path = file_path
-
-        file_contents = agent.codebase.retrieve_file(file_path).contents
+        file_contents = agent.open_file(file_path).contents
 
         observation_description = (
             f"Opened the file '{file_path}'. "
@@ -69,6 +67,10 @@ class OpenFileTool(Tool):
 
         return observation
 
+    def _restore_from_cache(self, agent: Agent, observation: Observation) -> None:
+        """Open the file in the file editor again."""
+        agent.open_file(self.arguments["file_path"])
+
 
 class EditFileTool(Tool):
     """Tool to edit the contents of a file."""
@@ -106,15 +108,19 @@ class EditFileTool(Tool):
     def _use(self, agent: Agent) -> Observation:
         """Edit the file open in the file editor."""
         commit_message = self.arguments["commit_message"]
-        new_contents = self.arguments["new_file_contents"]
+        new_contents = strip_code_fences(self.arguments["new_file_contents"])
         file_path = agent.open_file_relative_path
 
-        if new_contents.startswith("```"):
-            # Remove up until and including the newline after the first ```
-            new_contents = new_contents[new_contents.find("\n") + 1 :]
-        if new_contents.endswith("```"):
-            new_contents = new_contents[:-3]
-        new_contents = new_contents.lstrip()
+        # An edit that leaves the file unchanged does not need to be applied or linted again
+        if agent.codebase.retrieve_file(file_path).contents == new_contents:
+            observation_description = (
+                f"The new contents of the file '{file_path}' are identical to its current "
+                f"contents, so the file was not changed."
+            )
+            return Observation(
+                observation_description=observation_description,
+                summarised_observation_description=f"Made no changes to the file '{file_path}'.",
+            )
 
         agent.codebase.edit_file(file_path, new_contents)
 
@@ -183,7 +189,7 @@ class CreateFileTool(Tool):
         """Check that the file does not already exist in the codebase."""
         file_path = self.arguments["file_path"]
 
-        if file_path in agent.codebase.get_relative_file_paths():
+        if agent.codebase.contains_file(file_path):
             raise ValueError(
                 f"The file '{file_path}' already exists in the codebase. "
                 f"The files in the codebase are:\n{agent.codebase.formatted_relative_file_paths()}"
@@ -192,19 +198,12 @@ class CreateFileTool(Tool):
     def _use(self, agent: Agent) -> Observation:
         """Write the new file to the codebase."""
         file_path = self.arguments["file_path"]
-        file_contents = self.arguments["file_contents"]
-
-        if file_contents.startswith("```"):
-            # Remove up until and including the newline after the first ```
-            file_contents = file_contents[file_contents.find("\n") + 1 :]
-        if file_contents.endswith("```"):
-            file_contents = file_contents[:-3]
-        file_contents = file_contents.lstrip()
+        file_contents = strip_code_fences(self.arguments["file_contents"])
 
         agent.codebase.add_file(file_path, file_contents)
 
         # Open the new file in the file editor
-        agent.open_file_relative_path = file_path
+        agent.open_file(file_path)
 
         if file_path.endswith(".py"):
             python_file = True
@@ -280,6 +279,10 @@ class RunPythonScriptTool(Tool):
         ),
     ]
 
+    # The tool only reads the codebase, and runs in an isolated container. Its observation is not
+    # cached, as the output of a run can differ between runs of the same code (e.g., flaky tests).
+    PARALLEL_SAFE = True
+
     ENVIRONMENT_TO_IMAGE = {
         "python2": "python2-base:latest",
         "python3": "python3-base:latest",
@@ -288,22 +291,33 @@ class RunPythonScriptTool(Tool):
     }
     """Mapping of environment names to Docker image names."""
 
+    VALID_ENVIRONMENTS = frozenset(ENVIRONMENT_TO_IMAGE)
+    """Names of the valid environments."""
+
+    @classmethod
+    def prepare(cls, agent: Agent) -> None:
+        """Start the containers for the agent's warm environments in the background."""
+        for environment in agent.warm_environments:
+            if environment in cls.VALID_ENVIRONMENTS:
+                agent.sandbox.start_container_in_background(
+                    cls.ENVIRONMENT_TO_IMAGE[environment], gpus=True
+                )
+
     def _validate_argument_values(self, agent: Agent):
         """Check that the file exists in the codebase, and that the environment is valid."""
         script_path = self.arguments["script_path"]
 
-        if script_path not in agent.codebase.get_relative_file_paths():
+        if not agent.codebase.contains_file(script_path):
             raise ValueError(
                 f"The file '{script_path}' does not exist in the codebase."
                 f"The files in the codebase are: {agent.codebase.formatted_relative_file_paths()}"
             )
 
         environment = self.arguments["environment"]
-        environments = self.ENVIRONMENT_TO_IMAGE.keys()
-        if environment not in environments:
+        if environment not in self.VALID_ENVIRONMENTS:
             raise ValueError(
                 f"The environment '{environment}' is not valid. "
-                f"Valid environments are: {environments}"
+                f"Valid environments are: {self.ENVIRONMENT_TO_IMAGE.keys()}"
             )
 
     def _use(self, agent: Agent) -> Observation:
@@ -318,66 +332,36 @@ class RunPythonScriptTool(Tool):
 
         docker_image = self.ENVIRONMENT_TO_IMAGE[environment]
 
-        user_id = os.getuid()
-        group_id = os.getgid()
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Write the codebase to the temporary directory
-            agent.codebase.write_codebase_to_disk(output_path=temp_dir)
-
-            # Create a directory for pip cache and local
-            os.makedirs(os.path.join(temp_dir, "pip_cache"), exist_ok=True)
-            os.makedirs(os.path.join(temp_dir, "local"), exist_ok=True)
-
-            command = [
-                "docker",
-                "run",
-                "--gpus",
-                "all",
-                "--rm",
-                "--user",
-                f"{user_id}:{group_id}",
-                "-v",
-                f"{temp_dir}:/workspace",
-                "-w",
-                "/workspace/codebase",
-                "-e",
-                "HOME=/workspace",
-                "-e",
-                "PIP_CACHE_DIR=/workspace/pip_cache",
-                "-e",
-                "PYTHONUSERBASE=/workspace/local",
-                docker_image,
-                "bash",
-                "-c",
-                f"pip install --no-warn-script-location --no-python-version-warning --disable-pip-version-check --user -q . && python {script_path} {script_arguments} > /workspace/stdout.txt 2> /workspace/stderr.txt",
-            ]
-
-            try:
-                subprocess.run(command, check=True)
-            except subprocess.CalledProcessError:
-                error = True
-            else:
-                error = False
+        sandbox = agent.sandbox
+        sandbox.write_codebase(agent.codebase)
 
-            stdout_path = Path(temp_dir) / "stdout.txt"
-            stderr_path = Path(temp_dir) / "stderr.txt"
+        process = sandbox.execute(
+            docker_image,
+            f"python {script_path} {script_arguments}",
+            gpus=True,
+            install=True,
+            timeout=agent.command_timeout,
+        )
+        error = process.returncode != 0
+        stdout = process.stdout
+        stderr = process.stderr
 
-            with stdout_path.open("r") as fh:
-                stdout = fh.read()
-            with stderr_path.open("r") as fh:
-                stderr = fh.read()
+        # Filter stderr to keep only the Traceback
+        if stderr:
+            traceback_match = re.search(r"(Traceback[\s\S]*)", stderr)
+            if traceback_match:
+                stderr = traceback_match.group(1)
+                # Ensure the traceback is less than 10,000 characters
+                if len(stderr) > 10000:
+                    stderr = stderr[:10000] + "\n\n... (truncated)"
+            else:
+                stderr = "No Traceback found in stderr."
 
-            # Filter stderr to keep only the Traceback
-            if stderr:
-                traceback_match = re.search(r"(Traceback[\s\S]*)", stderr)
-                if traceback_match:
-                    stderr = traceback_match.group(1)
-                    # Ensure the traceback is less than 10,000 characters
-                    if len(stderr) > 10000:
-                        stderr = stderr[:10000] + "\n\n... (truncated)"
-                else:
-                    stderr = "No Traceback found in stderr."
+        if process.timed_out:
+            timeout_message = (
+                f"The script timed out after {agent.command_timeout} seconds, and was stopped."
+            )
+            stderr = f"{stderr}\n{timeout_message}" if stderr else timeout_message
 
         observation_description, summarised_observation_description = (
             self._create_observation_description(
@@ -413,19 +397,22 @@ class RunPythonScriptTool(Tool):
         error: bool,
     ) -> tuple[str, str]:
         """Create the observation description and summarised observation description."""
+        command = (
+            f"the command '{script_path} {script_arguments}' in the '{environment}' environment"
+        )
+
         if not error:
-            observation_description = (
-                f"Succesfully ran the command '{script_path} {script_arguments}' in the '{environment}' environment without errors.\n"
-                f"STDOUT:\n```\n{stdout}\n```"
-            )
-            summarised_observation_description = f"Succesfully ran the command '{script_path} {script_arguments}' in the '{environment}' environment without errors."
+            summarised_observation_description = f"Succesfully ran {command} without errors."
         else:
-            observation_description = (
-                f"Error when running the command '{script_path} {script_arguments}' in the '{environment}' environment.\n"
-                f"STDOUT:\n```\n{stdout}\n```\n"
-                f"STDERR:\n```\n{stderr}\n```"
-            )
-            summarised_observation_description = f"Error when running the command '{script_path} {script_arguments}' in the '{environment}' environment."
+            summarised_observation_description = f"Error when running {command}."
+
+        # The full description extends the summarised description with the output, which is
+        # truncated if it is very long
+        observation_description = (
+            f"{summarised_observation_description}\nSTDOUT:\n```\n{truncate_output(stdout)}\n```"
+        )
+        if error:
+            observation_description += f"\nSTDERR:\n```\n{stderr}\n```"
 
         return observation_description, summarised_observation_description
 
@@ -449,19 +436,35 @@ class RunAllTestsTool(Tool):
         ),
     ]
 
+    # The tool only reads the codebase, and runs in an isolated container. Its observation is not
+    # cached, as the output of a run can differ between runs of the same code (e.g., flaky tests).
+    PARALLEL_SAFE = True
+
     ENVIRONMENT_TO_IMAGE = {
         "python2": "python2-base:latest",
         "python3": "python3-base:latest",
     }
+    """Mapping of environment names to Docker image names."""
+
+    VALID_ENVIRONMENTS = frozenset(ENVIRONMENT_TO_IMAGE)
+    """Names of the valid environments."""
+
+    @classmethod
+    def prepare(cls, agent: Agent) -> None:
+        """Start the containers for the agent's warm environments in the background."""
+        for environment in agent.warm_environments:
+            if environment in cls.VALID_ENVIRONMENTS:
+                agent.sandbox.start_container_in_background(
+                    cls.ENVIRONMENT_TO_IMAGE[environment], gpus=False
+                )
 
     def _validate_argument_values(self, agent: Agent):
         """Check that the environment is valid."""
         environment = self.arguments["environment"]
-        environments = self.ENVIRONMENT_TO_IMAGE.keys()
-        if environment not in environments:
+        if environment not in self.VALID_ENVIRONMENTS:
             raise ValueError(
                 f"The environment '{environment}' is not valid. "
-                f"Valid environments are: {environments}"
+                f"Valid environments are: {self.ENVIRONMENT_TO_IMAGE.keys()}"
             )
 
     def _use(self, agent: Agent) -> Observation:
@@ -469,52 +472,21 @@ class RunAllTestsTool(Tool):
         environment = self.arguments["environment"]
         docker_image = self.ENVIRONMENT_TO_IMAGE[environment]
 
-        user_id = os.getuid()
-        group_id = os.getgid()
-
-        with tempfile.TemporaryDirectory() as temp_dir:
-            agent.codebase.write_codebase_to_disk(output_path=temp_dir)
-
-            # Create a directory for pip cache and local
-            os.makedirs(os.path.join(temp_dir, "pip_cache"), exist_ok=True)
-            os.makedirs(os.path.join(temp_dir, "local"), exist_ok=True)
-
-            command = [
-                "docker",
-                "run",
-                "--rm",
-                "--user",
-                f"{user_id}:{group_id}",
-                "-v",
-                f"{temp_dir}:/workspace",
-                "-w",
-                "/workspace/codebase",
-                "-e",
-                "HOME=/workspace",
-                "-e",
-                "PIP_CACHE_DIR=/workspace/pip_cache",
-                "-e",
-                "PYTHONUSERBASE=/workspace/local",
-                docker_image,
-                "bash",
-                "-c",
-                "pip install --no-python-version-warning --disable-pip-version-check --user -q . && pytest > /workspace/stdout.txt 2> /workspace/stderr.txt",
-            ]
-
-            try:
-                subprocess.run(command, check=True)
-            except subprocess.CalledProcessError:
-                tests_passed = False
-            else:
-                tests_passed = True
+        sandbox = agent.sandbox
+        sandbox.write_codebase(agent.codebase)
 
-            stdout_path = Path(temp_dir) / "stdout.txt"
-            stderr_path = Path(temp_dir) / "stderr.txt"
+        process = sandbox.execute(
+            docker_image, "pytest", install=True, timeout=agent.command_timeout
+        )
+        tests_passed = process.returncode == 0
+        stdout = process.stdout
+        stderr = process.stderr
 
-            with stdout_path.open("r") as fh:
-                stdout = fh.read()
-            with stderr_path.open("r") as fh:
-                stderr = fh.read()
+        if process.timed_out:
+            timeout_message = (
+                f"The tests timed out after {agent.command_timeout} seconds, and were stopped."
+            )
+            stderr = f"{stderr}\n{timeout_message}" if stderr else timeout_message
 
         observation_description, summarised_observation_description = (
             self._create_observation_description(environment, stdout, stderr, tests_passed)
@@ -539,30 +511,24 @@ class RunAllTestsTool(Tool):
         self, environment: str, stdout: str, stderr: str, tests_passed: bool
     ) -> tuple[str, str]:
         """Create the observation description and summarised observation description."""
+        ran_tests = f"Ran all tests in the codebase in the '{environment}' environment."
+
         if tests_passed:
-            observation_description = (
-                f"Ran all tests in the codebase in the '{environment}' environment.\n"
-                f"All tests ran successfully with no errors."
-            )
             summarised_observation_description = (
-                f"Ran all tests in the codebase in the '{environment}' environment.\n"
-                f"All tests ran successfully with no errors."
+                f"{ran_tests}\nAll tests ran successfully with no errors."
             )
+            observation_description = summarised_observation_description
 
         else:
-            observation_description = (
-                f"Ran all tests in the codebase in the '{environment}' environment.\n"
-                f"There were errors when running the tests."
-            )
             summarised_observation_description = (
-                f"Ran all tests in the codebase in the '{environment}' environment.\n"
-                f"There were errors when running the tests."
+                f"{ran_tests}\nThere were errors when running the tests."
             )
 
+            observation_description = summarised_observation_description
             if stdout:
-                observation_description += f"\STDOUT:\n```\n{stdout}\n```"
+                observation_description += f"\nSTDOUT:\n```\n{truncate_output(stdout)}\n```"
             if stderr:
-                observation_description += f"\nSTDERR:\n```\n{stderr}\n```"
+                observation_description += f"\nSTDERR:\n```\n{truncate_output(stderr)}\n```"
 
         return observation_description, summarised_observation_description
 
@@ -1,15 +1,32 @@
 """Utility functions for tools."""
 
-import json
+import functools
 import subprocess
 import tempfile
-from pathlib import Path
+
+from loguru import logger
+
+# orjson parses JSON considerably faster than the standard library, so it is used if installed
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+from pythoneer.tools.ruff_server import RuffServer
+
+
+_RUFF_SERVER = RuffServer()
+"""Ruff server shared by all calls to `lint_code`."""
 
 
 def lint_code(code_string: str) -> list[str] | None:
     """
     Lint a code block using Ruff.
 
+    The code is linted by a long-running Ruff server. If the server is unavailable, Ruff is run
+    as a one-off command instead. The results for recently linted code are cached, as the same
+    code is often linted more than once (e.g., when an edit is repeated).
+
     Parameters
     ----------
     code_string : str
@@ -21,27 +38,101 @@ def lint_code(code_string: str) -> list[str] | None:
         A list of formatted violations, where each violation is a string in the format
         'line:column - code: message'. If there are no violations, returns None.
     """
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".py", delete=True) as temp_file:
-        # Write the code to the temporary file
-        temp_file.write(code_string)
-        temp_file.flush()
-        temp_file_path = Path(temp_file.name)
-
-        # Run Ruff on the temporary file
-        result = subprocess.run(
-            ["ruff", "check", str(temp_file_path), "--output-format=json"],
-            capture_output=True,
-            text=True,
-        )
-
-        # Parse the JSON output
-        if result.stdout:
-            violations = json.loads(result.stdout)
-            formatted_violations = [
-                f"{v['location']['row']}:{v['location']['column']} - {v['code']}: {v['message']}"
-                for v in violations
-            ]
-        else:
-            formatted_violations = None
-
-        return formatted_violations
+    formatted_violations = _lint_code_cached(code_string)
+
+    # A new list is returned, so that the cached result cannot be modified
+    return list(formatted_violations) or None
+
+
+@functools.lru_cache(maxsize=128)
+def _lint_code_cached(code_string: str) -> tuple[str, ...]:
+    """Lint a code string, and return the formatted violations."""
+    try:
+        violations = _RUFF_SERVER.check(code_string)
+    except RuntimeError as exc:
+        logger.warning(f"Linting with the Ruff server failed, running Ruff directly: {exc}")
+        violations = _lint_code_with_command(code_string)
+
+    return tuple(f"{row}:{column} - {code}: {message}" for row, column, code, message in violations)
+
+
+def _lint_code_with_command(code_string: str) -> list[tuple[int, int, str | None, str]]:
+    """Lint a code string by running Ruff as a one-off command."""
+    # The code is passed on stdin, so that it does not need to be written to a temporary file.
+    # Ruff is run from the temporary directory, so that the configuration of the project that
+    # the agent is run from is not picked up.
+    result = subprocess.run(
+        ["ruff", "check", "--stdin-filename", "snippet.py", "--output-format=json", "-"],
+        input=code_string,
+        capture_output=True,
+        text=True,
+        cwd=tempfile.gettempdir(),
+    )
+
+    # Parse the JSON output
+    if not result.stdout:
+        return []
+
+    return [
+        (v["location"]["row"], v["location"]["column"], v["code"], v["message"])
+        for v in json_loads(result.stdout)
+    ]
+
+
+def strip_code_fences(contents: str) -> str:
+    """
+    Remove the Markdown code fences that the language model sometimes wraps file contents in.
+
+    Parameters
+    ----------
+    contents : str
+        The file contents, possibly wrapped in code fences (e.g., "```python\n...\n```").
+
+    Returns
+    -------
+    stripped_contents : str
+        The file contents without the code fences, or any leading whitespace.
+    """
+    if contents.startswith("```"):
+        # Remove up until and including the newline after the opening fence, which may be
+        # followed by a language name
+        contents = contents[contents.find("\n") + 1 :]
+
+    return contents.removesuffix("```").lstrip()
+
+
+MAX_OUTPUT_CHARACTERS = 20000
+"""
+Maximum number of characters of a command's output to show to the language model. The full
+output is still recorded in the trajectory, as the terminal content.
+"""
+
+
+def truncate_output(output: str, max_characters: int = MAX_OUTPUT_CHARACTERS) -> str:
+    """
+    Truncate the output of a command, keeping its start and its end.
+
+    Parameters
+    ----------
+    output : str
+        The output to truncate.
+
+    max_characters : int
+        The maximum number of characters of the output to keep.
+
+    Returns
+    -------
+    truncated_output : str
+        The output, with the middle replaced by a note if it is longer than `max_characters`.
+    """
+    if len(output) <= max_characters:
+        return output
+
+    head_characters = max_characters // 2
+    tail_characters = max_characters - head_characters
+    truncated_characters = len(output) - max_characters
+
+    return (
+        f"{output[:head_characters]}\n\n... ({truncated_characters} characters truncated) ...\n\n"
+        f"{output[-tail_characters:]}"
+    )
@@ -9,17 +9,55 @@ behaviour.
 from __future__ import annotations
 
 import json
-
+import queue
+import threading
 from dataclasses import dataclass, asdict
 from pathlib import Path
 
+# orjson serialises JSON considerably faster than the standard library, so it is used if installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 class Trajectory:
     """Class to represent an agent's trajectory."""
 
-    def __init__(self) -> None:
+    STREAM_FILE_NAME = "trajectory.jsonl"
+    """Name of the file that the steps are appended to as they are added."""
+
+    def __init__(self, output_dir: str | Path | None = None) -> None:
+        """
+        Initialise the Trajectory object.
+
+        Parameters
+        ----------
+        output_dir : str | Path | None
+            The directory to stream the trajectory to. If provided, each step is appended to a
+            JSON Lines file in this directory as soon as it is added, so that the trajectory is
+            not lost if the run crashes. The file is written by a background thread, so that
+            adding a step never blocks on disk I/O.
+        """
         self.steps: list[TrajectoryStep] = []
 
+        # The steps as dictionaries, resolved once when they are added (see `resolved_steps`)
+        self._resolved_steps: list[dict] = []
+
+        # The most recent contents of the file viewer, used to resolve the steps
+        self._file_viewer_content: str | None = None
+
+        self._queue: queue.Queue[dict | None] | None = None
+        self._writer: threading.Thread | None = None
+        if output_dir is not None:
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(
+                target=self._write_stream,
+                args=(Path(output_dir) / self.STREAM_FILE_NAME,),
+                daemon=True,
+            )
+            self._writer.start()
+
     def add_step(self, step: TrajectoryStep) -> None:
         """
         Add a step to the trajectory.
@@ -31,22 +69,85 @@ class Trajectory:
         """
         self.steps.append(step)
 
+        if step.file_viewer_changed:
+            self._file_viewer_content = step.file_viewer_content
+
+        # Steps are not modified after they are added, so each step is only resolved once
+        resolved_step = self._resolve_step(step, self._file_viewer_content)
+        self._resolved_steps.append(resolved_step)
+
+        if self._queue is not None:
+            self._queue.put(resolved_step)
+
+    def close(self) -> None:
+        """Wait for all streamed steps to be written, and close the stream."""
+        if self._writer is None:
+            return
+
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        self._queue = None
+
+    def _write_stream(self, file_path: Path) -> None:
+        """Write the resolved steps from the queue to disk, one per line, until closed."""
+        with open(file_path, "ab") as fh:
+            while (resolved_step := self._queue.get()) is not None:
+                fh.write(_dumps(resolved_step) + b"\n")
+                fh.flush()
+
     def write_to_disk(self, output_dir: str | Path) -> None:
         """
         Write the trajectory to disk as a JSON file.
 
+        Any streamed steps are flushed to disk first.
+
         Parameters
         ----------
         output_dir : str | Path
             The directory to write the trajectory to.
         """
+        self.close()
+
         file_name = "trajectory.json"
         output_dir = Path(output_dir)
         file_path = output_dir / file_name
 
-        with open(file_path, "w") as fh:
-            trajectory = [asdict(step) for step in self.steps]
-            json.dump(trajectory, fh, indent=4)
+        with open(file_path, "wb") as fh:
+            fh.write(_dumps(self.resolved_steps(), indent=True))
+
+    def resolved_steps(self) -> list[dict]:
+        """
+        Return the steps as dictionaries, with the file viewer content filled in for every step.
+
+        To save memory, the contents of the file viewer are only stored for the steps where they
+        changed. The contents for the other steps are resolved from the most recent change.
+
+        The steps are resolved when they are added, so this does not convert them again. The
+        returned dictionaries are shared, so they must not be modified.
+
+        Returns
+        -------
+        resolved_steps : list[dict]
+            The steps of the trajectory, as JSON serialisable dictionaries.
+        """
+        return list(self._resolved_steps)
+
+    @staticmethod
+    def _resolve_step(step: TrajectoryStep, file_viewer_content: str | None) -> dict:
+        """Return a step as a dictionary, with the given file viewer content filled in."""
+        resolved_step = asdict(step)
+        if step.open_file_name:
+            resolved_step["file_viewer_content"] = file_viewer_content
+        return resolved_step
+
+
+def _dumps(obj: list | dict, indent: bool = False) -> bytes:
+    """Serialise an object to UTF-8 encoded JSON, indented by two spaces if specified."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False).encode("utf-8")
 
 
 @dataclass
@@ -80,8 +181,9 @@ class TrajectoryStep:
     open_file_name : str | None
         The name of the file that the agent most recently opened in the file viewer.
 
-    file_viewer_content : str
-        The most recent contents of the file viewer. This is the content after the tool was used.
+    file_viewer_content : str | None
+        The contents of the file viewer after the tool was used. This is only stored if the
+        tool changed the contents of the file viewer (see `Trajectory.resolved_steps`).
 
     review_comment : str | None
         A comment from the reviewer about the step.
@@ -1,5 +1,6 @@
 """Run the agent."""
 
+import asyncio
 from argparse import ArgumentParser
 
 from pythoneer.agent import Agent
@@ -46,7 +47,7 @@ def main():
         codebase_path=args.codebase_path,
         workspace_path=args.workspace_path,
     )
-    agent.run()
+    asyncio.run(agent.run())
 
 
 if __name__ == "__main__":